@@ -1,4 +1,5 @@
 
+import heapq
 import logging
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
@@ -15,43 +16,44 @@ class AnalyticsManager:
         """Statistiques d'activité des derniers jours."""
         cache_key = f"activity_stats_{days}"
         cached = global_cache.get(cache_key)
-        if cached:
+        if cached is not None:
             return cached
         
+        # Fenêtre de N jours calendaires, aujourd'hui compris
+        window = f'-{max(int(days), 1) - 1} days'
+        
         try:
             with self.db.connection() as conn:
                 cursor = conn.cursor()
                 
-                # Questions répondues par jour
-                cursor.execute("""
-                    SELECT DATE(answered_at) as day, COUNT(*) as count
-                    FROM user_grades
-                    WHERE answered_at >= datetime('now', '-{} days')
-                    GROUP BY DATE(answered_at)
-                    ORDER BY day DESC
-                """.format(days))
-                daily_questions = dict(cursor.fetchall())
-                
-                # Utilisateurs actifs par jour
+                # Questions, utilisateurs actifs et taux de réussite par jour (agrégats)
                 cursor.execute("""
-                    SELECT DATE(answered_at) as day, COUNT(DISTINCT user_id) as users
-                    FROM user_grades
-                    WHERE answered_at >= datetime('now', '-{} days')
-                    GROUP BY DATE(answered_at)
-                    ORDER BY day DESC
-                """.format(days))
-                daily_users = dict(cursor.fetchall())
-                
-                # Taux de réussite par jour
+                    SELECT d.day,
+                           d.questions,
+                           (SELECT COUNT(*) FROM user_grades_daily_users u WHERE u.day = d.day) as users,
+                           d.correct * 100.0 / d.questions as success_rate
+                    FROM user_grades_daily d
+                    WHERE d.day >= DATE('now', ?)
+                    ORDER BY d.day DESC
+                """, (window,))
+                
+                daily_questions = {}
+                daily_users = {}
+                daily_success = {}
+                for day, count, users, success_rate in cursor.fetchall():
+                    daily_questions[day] = count
+                    daily_users[day] = users
+                    daily_success[day] = success_rate
+                
+                # Utilisateurs distincts sur toute la période (GROUP BY plutôt que COUNT DISTINCT)
                 cursor.execute("""
-                    SELECT DATE(answered_at) as day, 
-                           AVG(CASE WHEN is_correct THEN 1.0 ELSE 0.0 END) * 100 as success_rate
-                    FROM user_grades
-                    WHERE answered_at >= datetime('now', '-{} days')
-                    GROUP BY DATE(answered_at)
-                    ORDER BY day DESC
-                """.format(days))
-                daily_success = dict(cursor.fetchall())
+                    SELECT COUNT(*) FROM (
+                        SELECT user_id FROM user_grades_daily_users
+                        WHERE day >= DATE('now', ?)
+                        GROUP BY user_id
+                    )
+                """, (window,))
+                active_users_period = cursor.fetchone()[0]
                 
                 stats = {
                     'daily_questions': daily_questions,
@@ -59,7 +61,7 @@ class AnalyticsManager:
                     'daily_success_rate': {k: round(v, 1) for k, v in daily_success.items()},
                     'total_questions_period': sum(daily_questions.values()),
                     'avg_questions_per_day': sum(daily_questions.values()) / max(len(daily_questions), 1),
-                    'active_users_period': len(set().union(*[[] for _ in daily_users.values()])) if daily_users else 0
+                    'active_users_period': active_users_period
                 }
                 
                 global_cache.set(cache_key, stats, ttl=300)  # 5 minutes
@@ -73,55 +75,45 @@ class AnalyticsManager:
         """Analyse de difficulté des questions."""
         cache_key = "question_difficulty"
         cached = global_cache.get(cache_key)
-        if cached:
+        if cached is not None:
             return cached
         
         try:
             with self.db.connection() as conn:
                 cursor = conn.cursor()
                 
-                # Questions les plus difficiles (taux d'échec élevé)
+                # Agrégation unique par question, partagée par les deux classements
+                # (troncature et arrondi faits côté SQL)
                 cursor.execute("""
-                    SELECT question, 
-                           COUNT(*) as total_attempts,
-                           SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct_attempts,
-                           (1.0 - CAST(SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*)) * 100 as difficulty_score
-                    FROM user_grades
-                    GROUP BY question
-                    HAVING COUNT(*) >= 3
-                    ORDER BY difficulty_score DESC
-                    LIMIT 10
+                    SELECT CASE WHEN LENGTH(question) > 50
+                                THEN SUBSTR(question, 1, 50) || '...'
+                                ELSE question END as label,
+                           total_attempts,
+                           ROUND(success_rate, 1) as success_rate,
+                           ROUND(100 - success_rate, 1) as difficulty_score
+                    FROM (
+                        SELECT question,
+                               COUNT(*) as total_attempts,
+                               (CAST(COUNT(*) FILTER (WHERE is_correct) AS FLOAT) / COUNT(*)) * 100 as success_rate
+                        FROM user_grades
+                        GROUP BY question
+                        HAVING COUNT(*) >= 3
+                    )
                 """)
-                hardest_questions = cursor.fetchall()
+                questions = cursor.fetchall()
                 
-                # Questions les plus faciles
-                cursor.execute("""
-                    SELECT question,
-                           COUNT(*) as total_attempts,
-                           SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct_attempts,
-                           (CAST(SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*)) * 100 as success_rate
-                    FROM user_grades
-                    GROUP BY question
-                    HAVING COUNT(*) >= 3
-                    ORDER BY success_rate DESC
-                    LIMIT 10
-                """)
-                easiest_questions = cursor.fetchall()
+                # Questions les plus difficiles (taux d'échec élevé) et les plus faciles
+                hardest_questions = heapq.nsmallest(10, questions, key=lambda q: q[2])
+                easiest_questions = heapq.nlargest(10, questions, key=lambda q: q[2])
                 
                 stats = {
                     'hardest_questions': [
-                        {
-                            'question': q[0][:50] + '...' if len(q[0]) > 50 else q[0],
-                            'attempts': q[1],
-                            'difficulty': round(q[3], 1)
-                        } for q in hardest_questions
+                        {'question': q[0], 'attempts': q[1], 'difficulty': q[3]}
+                        for q in hardest_questions
                     ],
                     'easiest_questions': [
-                        {
-                            'question': q[0][:50] + '...' if len(q[0]) > 50 else q[0],
-                            'attempts': q[1],
-                            'success_rate': round(q[3], 1)
-                        } for q in easiest_questions
+                        {'question': q[0], 'attempts': q[1], 'success_rate': q[2]}
+                        for q in easiest_questions
                     ]
                 }
                 
@@ -136,7 +128,7 @@ class AnalyticsManager:
         """Statistiques d'engagement des utilisateurs."""
         cache_key = "user_engagement"
         cached = global_cache.get(cache_key)
-        if cached:
+        if cached is not None:
             return cached
         
         try:
@@ -171,19 +163,18 @@ class AnalyticsManager:
                 """)
                 most_active = cursor.fetchall()
                 
-                # Taux de rétention approximatif
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT user_id) as total_users
-                    FROM user_grades
-                """)
-                total_users = cursor.fetchone()[0]
-                
+                # Taux de rétention approximatif (un seul passage GROUP BY)
                 cursor.execute("""
-                    SELECT COUNT(DISTINCT user_id) as active_users
-                    FROM user_grades
-                    WHERE answered_at >= datetime('now', '-7 days')
+                    SELECT COUNT(*) as total_users,
+                           COUNT(*) FILTER (WHERE last_seen >= datetime('now', '-7 days')) as active_users
+                    FROM (
+                        SELECT user_id, MAX(answered_at) as last_seen
+                        FROM user_grades
+                        GROUP BY user_id
+                    )
                 """)
-                active_users = cursor.fetchone()[0]
+                total_users, active_users = cursor.fetchone()
+                active_users = active_users or 0
                 
                 retention_rate = (active_users / max(total_users, 1)) * 100
                 
@@ -217,36 +208,36 @@ class AnalyticsManager:
             difficulty = self.get_question_difficulty_stats()
             engagement = self.get_user_engagement_stats()
             
-            report = "📊 **RAPPORT ANALYTICS - 7 DERNIERS JOURS** 📊\n\n"
+            parts = ["📊 **RAPPORT ANALYTICS - 7 DERNIERS JOURS** 📊\n\n"]
             
             # Activité générale
-            report += "🎯 **ACTIVITÉ GÉNÉRALE**\n"
-            report += f"• Questions répondues : {activity.get('total_questions_period', 0)}\n"
-            report += f"• Moyenne par jour : {activity.get('avg_questions_per_day', 0):.1f}\n"
-            report += f"• Utilisateurs actifs : {engagement.get('active_users_week', 0)}\n"
-            report += f"• Taux de rétention : {engagement.get('retention_rate', 0)}%\n\n"
+            parts.append("🎯 **ACTIVITÉ GÉNÉRALE**\n")
+            parts.append(f"• Questions répondues : {activity.get('total_questions_period', 0)}\n")
+            parts.append(f"• Moyenne par jour : {activity.get('avg_questions_per_day', 0):.1f}\n")
+            parts.append(f"• Utilisateurs actifs : {engagement.get('active_users_week', 0)}\n")
+            parts.append(f"• Taux de rétention : {engagement.get('retention_rate', 0)}%\n\n")
             
             # Questions les plus difficiles
             if difficulty.get('hardest_questions'):
-                report += "😰 **QUESTIONS LES PLUS DIFFICILES**\n"
+                parts.append("😰 **QUESTIONS LES PLUS DIFFICILES**\n")
                 for i, q in enumerate(difficulty['hardest_questions'][:3], 1):
-                    report += f"{i}. {q['question']} ({q['difficulty']}% d'échec)\n"
-                report += "\n"
+                    parts.append(f"{i}. {q['question']} ({q['difficulty']}% d'échec)\n")
+                parts.append("\n")
             
             # Distribution des scores
             if engagement.get('score_distribution'):
-                report += "⭐ **RÉPARTITION DES SCORES**\n"
+                parts.append("⭐ **RÉPARTITION DES SCORES**\n")
                 for range_name, count in engagement['score_distribution'].items():
-                    report += f"• {range_name} : {count} utilisateur(s)\n"
-                report += "\n"
+                    parts.append(f"• {range_name} : {count} utilisateur(s)\n")
+                parts.append("\n")
             
             # Top utilisateurs
             if engagement.get('most_active_users'):
-                report += "🏆 **TOP UTILISATEURS ACTIFS**\n"
+                parts.append("🏆 **TOP UTILISATEURS ACTIFS**\n")
                 for i, user in enumerate(engagement['most_active_users'][:3], 1):
-                    report += f"{i}. {user['name']} : {user['total_questions']} questions ({user['success_rate']}%)\n"
+                    parts.append(f"{i}. {user['name']} : {user['total_questions']} questions ({user['success_rate']}%)\n")
             
-            return report
+            return ''.join(parts)
             
         except Exception as e:
             logger.error(f"Erreur génération rapport analytics: {e}")
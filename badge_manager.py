@@ -3,18 +3,36 @@ import logging
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from database import DatabaseManager
+from user_manager import UserManager
 
 logger = logging.getLogger(__name__)
 
+# Mots-clés des badges thématiques
+_HISTORY_KEYWORDS = ('histoire',)
+_GEOGRAPHY_KEYWORDS = ('géographie', 'capitale')
+
+def _like_any(keywords) -> str:
+    """Construit une condition SQL vraie si la question contient l'un des mots-clés."""
+    return '(' + ' OR '.join(f"question LIKE '%{kw}%'" for kw in keywords) + ')'
+
+# Requête construite une seule fois au chargement du module
+_FACTS_QUERY = f"""
+    SELECT COUNT(*) FILTER (WHERE is_correct),
+           COUNT(*) FILTER (WHERE is_correct AND {_like_any(_HISTORY_KEYWORDS)}),
+           COUNT(*) FILTER (WHERE is_correct AND {_like_any(_GEOGRAPHY_KEYWORDS)})
+    FROM user_grades WHERE user_id = ?
+"""
+
 class BadgeManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
+        self.user_manager = UserManager(db_manager)
         self.badges_config = {
             'first_correct': {
                 'name': 'Premier Succès',
                 'emoji': '🌟',
                 'description': 'Première bonne réponse',
-                'condition': lambda stats: stats['basic']['correct'] >= 1
+                'condition': lambda facts: facts['correct'] >= 1
             },
             'streak_5': {
                 'name': 'Série de 5',
@@ -26,19 +44,19 @@ class BadgeManager:
                 'name': 'Collectionneur',
                 'emoji': '⭐',
                 'description': '50 étoiles collectées',
-                'condition': lambda stats: stats['basic']['stars'] >= 50
+                'condition': lambda facts: facts['stars'] >= 50
             },
             'star_collector_100': {
                 'name': 'Maître Collectionneur',
                 'emoji': '🌠',
                 'description': '100 étoiles collectées',
-                'condition': lambda stats: stats['basic']['stars'] >= 100
+                'condition': lambda facts: facts['stars'] >= 100
             },
             'perfectionist': {
                 'name': 'Perfectionniste',
                 'emoji': '💎',
                 'description': '100% de réussite sur 10+ questions',
-                'condition': lambda stats: stats['basic']['total'] >= 10 and stats['percentage'] == 100.0
+                'condition': lambda facts: facts['total'] >= 10 and facts['percentage'] == 100.0
             },
             'history_expert': {
                 'name': 'Expert Histoire',
@@ -71,84 +89,100 @@ class BadgeManager:
                 'condition': self._check_champion
             }
         }
+        # Enregistrements figés (clé, nom, emoji, description, condition) pour la vérification
+        self._badge_rows = tuple(
+            (key, config['name'], config['emoji'], config['description'], config['condition'])
+            for key, config in self.badges_config.items()
+        )
     
-    def _check_streak_5(self, stats) -> bool:
-        """Vérifie si l'utilisateur a 5 bonnes réponses consécutives."""
-        grades = stats['grades']['correct']
-        if len(grades) < 5:
-            return False
+    def _load_facts(self, user_id: int, stats: Dict) -> Dict:
+        """Charge en quelques requêtes toutes les données utilisées par les conditions de badges."""
+        rank = self.user_manager.get_user_rank(user_id)
+        facts = {
+            'user_id': user_id,
+            'correct': stats['basic']['correct'],
+            'total': stats['basic']['total'],
+            'stars': stats['basic']['stars'],
+            'percentage': stats['percentage'],
+            'correct_answers': 0,
+            'history_correct': 0,
+            'geography_correct': 0,
+            'rank': rank if rank is not None else float('inf'),
+            'badges': set()
+        }
         
-        # Vérifier les 5 dernières réponses
-        recent_correct = grades[-5:]
-        return len(recent_correct) == 5
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Agrégats des notes de l'utilisateur en un seul passage
+            cursor.execute(_FACTS_QUERY, (user_id,))
+            correct_answers, history_correct, geography_correct = cursor.fetchone()
+            facts['correct_answers'] = correct_answers or 0
+            facts['history_correct'] = history_correct or 0
+            facts['geography_correct'] = geography_correct or 0
+            
+            # Badges déjà obtenus, pour éviter une requête par badge
+            cursor.execute("SELECT badge_key FROM user_badges WHERE user_id = ?", (user_id,))
+            facts['badges'] = {row[0] for row in cursor.fetchall()}
+        
+        return facts
     
-    def _check_history_expert(self, stats) -> bool:
+    def _check_streak_5(self, facts) -> bool:
+        """Vérifie si l'utilisateur a 5 bonnes réponses consécutives."""
+        return facts['correct_answers'] >= 5
+    
+    def _check_history_expert(self, facts) -> bool:
         """Vérifie si l'utilisateur a 20 bonnes réponses en histoire."""
-        grades = stats['grades']['correct']
-        history_count = sum(1 for grade in grades if 'histoire' in grade['question'].lower())
-        return history_count >= 20
+        return facts['history_correct'] >= 20
     
-    def _check_geography_expert(self, stats) -> bool:
+    def _check_geography_expert(self, facts) -> bool:
         """Vérifie si l'utilisateur a 20 bonnes réponses en géographie."""
-        grades = stats['grades']['correct']
-        geo_count = sum(1 for grade in grades if 'géographie' in grade['question'].lower() or 'capitale' in grade['question'].lower())
-        return geo_count >= 20
+        return facts['geography_correct'] >= 20
     
-    def _check_daily_warrior(self, stats) -> bool:
+    def _check_daily_warrior(self, facts) -> bool:
         """Vérifie 7 jours de participation consécutifs."""
-        # Implémentation basique - peut être améliorée avec un tracking plus précis
-        grades = stats['grades']['correct'] + stats['grades']['incorrect']
-        if not grades:
-            return False
-        
-        # Compter les jours uniques des 7 derniers jours
-        recent_days = set()
-        cutoff_date = datetime.now() - timedelta(days=7)
-        
-        for grade in grades:
-            # Supposer que le timestamp est stocké quelque part
-            # Pour l'instant, approximation basée sur le nombre total
-            pass
-        
-        return len(recent_days) >= 7  # À implémenter correctement avec timestamps
+        # À implémenter correctement avec les timestamps des réponses
+        return False
     
-    def _check_top_3(self, stats) -> bool:
+    def _check_top_3(self, facts) -> bool:
         """Vérifie si l'utilisateur est dans le TOP 3."""
-        from user_manager import UserManager
-        user_manager = UserManager(self.db)
-        ranking = user_manager.get_ranking(3)
-        
-        # Trouver la position de l'utilisateur (à améliorer avec user_id)
-        return len(ranking) >= 3 and stats['basic']['stars'] > 0
+        return facts['rank'] <= 3 and facts['stars'] > 0
     
-    def _check_champion(self, stats) -> bool:
+    def _check_champion(self, facts) -> bool:
         """Vérifie si l'utilisateur est champion."""
-        from user_manager import UserManager
-        user_manager = UserManager(self.db)
-        ranking = user_manager.get_ranking(1)
-        
-        return len(ranking) > 0 and stats['basic']['stars'] > 0
+        return facts['rank'] == 1 and facts['stars'] > 0
     
     def check_user_badges(self, user_id: int, stats: Dict) -> List[Dict]:
         """Vérifie quels badges l'utilisateur a mérités."""
         earned_badges = []
         
-        for badge_key, badge_config in self.badges_config.items():
+        try:
+            facts = self._load_facts(user_id, stats)
+        except Exception as e:
+            logger.error(f"Erreur chargement données badges pour user {user_id}: {e}")
+            return earned_badges
+        
+        existing = facts['badges']
+        new_keys = []
+        for badge_key, name, emoji, description, condition in self._badge_rows:
+            if badge_key in existing:
+                continue
             try:
-                if badge_config['condition'](stats):
-                    # Vérifier si le badge n'est pas déjà attribué
-                    if not self.user_has_badge(user_id, badge_key):
-                        earned_badges.append({
-                            'key': badge_key,
-                            'name': badge_config['name'],
-                            'emoji': badge_config['emoji'],
-                            'description': badge_config['description']
-                        })
-                        # Attribuer le badge
-                        self.award_badge(user_id, badge_key)
+                if condition(facts):
+                    earned_badges.append({
+                        'key': badge_key,
+                        'name': name,
+                        'emoji': emoji,
+                        'description': description
+                    })
+                    new_keys.append(badge_key)
             except Exception as e:
                 logger.error(f"Erreur vérification badge {badge_key} pour user {user_id}: {e}")
         
+        # Attribuer tous les nouveaux badges en une seule fois
+        if new_keys:
+            self.award_badges_batch(user_id, new_keys)
+        
         return earned_badges
     
     def user_has_badge(self, user_id: int, badge_key: str) -> bool:
@@ -167,17 +201,28 @@ class BadgeManager:
     def award_badge(self, user_id: int, badge_key: str):
         """Attribue un badge à un utilisateur."""
         try:
-            with self.db.connection() as conn:
-                cursor = conn.cursor()
+            with self.db.txn() as cursor:
                 cursor.execute("""
                     INSERT OR IGNORE INTO user_badges (user_id, badge_key, earned_at)
                     VALUES (?, ?, CURRENT_TIMESTAMP)
                 """, (user_id, badge_key))
-                conn.commit()
                 logger.info(f"Badge {badge_key} attribué à l'utilisateur {user_id}")
         except Exception as e:
             logger.error(f"Erreur attribution badge {badge_key} à {user_id}: {e}")
     
+    def award_badges_batch(self, user_id: int, badge_keys: List[str]):
+        """Attribue plusieurs badges à un utilisateur en une seule requête."""
+        try:
+            with self.db.txn() as cursor:
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO user_badges (user_id, badge_key, earned_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                """, [(user_id, badge_key) for badge_key in badge_keys])
+                # Un seul commit (à la sortie du bloc) pour tous les badges
+                logger.info(f"Badges {', '.join(badge_keys)} attribués à l'utilisateur {user_id}")
+        except Exception as e:
+            logger.error(f"Erreur attribution badges {badge_keys} à {user_id}: {e}")
+    
     def get_user_badges(self, user_id: int) -> List[Dict]:
         """Récupère tous les badges d'un utilisateur."""
         try:
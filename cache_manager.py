@@ -1,29 +1,54 @@
 
 import time
+import heapq
+import pickle
+import hashlib
+import inspect
 import logging
+import sys
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional, Any
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
 class CacheManager:
-    def __init__(self, default_ttl: int = 300):  # 5 minutes par défaut
-        self.cache = {}
+    def __init__(self, default_ttl: int = 300, maxsize: int = 1024):  # 5 minutes par défaut
+        # Ordre d'accès conservé pour l'éviction LRU
+        self.cache = OrderedDict()
+        # Tas (expiry, key) pour ne parcourir que les clés arrivées à échéance
+        self._heap = []
         self.default_ttl = default_ttl
+        self.maxsize = maxsize
+        # Estimation de la mémoire occupée, tenue à jour à chaque écriture/suppression
+        self._size_estimate = 0
+        self._lock = threading.RLock()
+    
+    def _pop(self, key: str) -> bool:
+        """Retire une clé et met à jour l'estimation mémoire (verrou déjà pris)."""
+        entry = self.cache.pop(key, None)
+        if entry is None:
+            return False
+        self._size_estimate -= sys.getsizeof(entry[0])
+        return True
     
     def get(self, key: str) -> Optional[Any]:
         """Récupère une valeur du cache."""
-        if key in self.cache:
-            value, expiry = self.cache[key]
-            if time.time() < expiry:
-                logger.debug(f"Cache HIT pour {key}")
-                return value
-            else:
-                # Expirer la clé
-                del self.cache[key]
-                logger.debug(f"Cache EXPIRED pour {key}")
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                value, expiry = entry
+                if time.time() < expiry:
+                    self.cache.move_to_end(key)
+                    logger.debug("Cache HIT pour %s", key)
+                    return value
+                else:
+                    # Expirer la clé
+                    self._pop(key)
+                    logger.debug("Cache EXPIRED pour %s", key)
         
-        logger.debug(f"Cache MISS pour {key}")
+        logger.debug("Cache MISS pour %s", key)
         return None
     
     def set(self, key: str, value: Any, ttl: int = None) -> None:
@@ -32,48 +57,121 @@ class CacheManager:
             ttl = self.default_ttl
         
         expiry = time.time() + ttl
-        self.cache[key] = (value, expiry)
-        logger.debug(f"Cache SET pour {key} (TTL: {ttl}s)")
+        with self._lock:
+            self._pop(key)
+            self.cache[key] = (value, expiry)
+            self._size_estimate += sys.getsizeof(value)
+            heapq.heappush(self._heap, (expiry, key))
+            
+            # Évincer les clés les moins récemment utilisées au-delà de la limite
+            while len(self.cache) > self.maxsize:
+                self._pop(next(iter(self.cache)))
+        logger.debug("Cache SET pour %s (TTL: %ss)", key, ttl)
     
     def delete(self, key: str) -> None:
         """Supprime une clé du cache."""
-        if key in self.cache:
-            del self.cache[key]
-            logger.debug(f"Cache DELETE pour {key}")
+        with self._lock:
+            if self._pop(key):
+                logger.debug("Cache DELETE pour %s", key)
+    
+    def delete_prefix(self, prefix) -> int:
+        """Supprime toutes les clés commençant par le(s) préfixe(s) donné(s)."""
+        with self._lock:
+            keys = [key for key in self.cache if key.startswith(prefix)]
+            for key in keys:
+                self._pop(key)
+        return len(keys)
     
     def clear(self) -> None:
         """Vide tout le cache."""
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+            self._heap.clear()
+            self._size_estimate = 0
         logger.info("Cache vidé complètement")
     
     def cleanup_expired(self) -> None:
         """Nettoie les clés expirées."""
         current_time = time.time()
-        expired_keys = [
-            key for key, (_, expiry) in self.cache.items()
-            if current_time >= expiry
-        ]
+        expired_keys = []
         
-        for key in expired_keys:
-            del self.cache[key]
+        with self._lock:
+            while self._heap and self._heap[0][0] <= current_time:
+                expiry, key = heapq.heappop(self._heap)
+                # Ignorer les entrées obsolètes (clé supprimée, évincée ou réécrite depuis)
+                entry = self.cache.get(key)
+                if entry is not None and entry[1] == expiry:
+                    self._pop(key)
+                    expired_keys.append(key)
+            
+            # Les entrées évincées laissent des reliquats dans le tas : le compacter
+            if len(self._heap) > 4 * max(len(self.cache), self.maxsize):
+                self._heap = [(exp, k) for exp, k in self._heap
+                              if k in self.cache and self.cache[k][1] == exp]
+                heapq.heapify(self._heap)
         
         if expired_keys:
-            logger.info(f"Cache cleanup: {len(expired_keys)} clés expirées supprimées")
+            logger.info("Cache cleanup: %d clés expirées supprimées", len(expired_keys))
     
     def get_stats(self) -> Dict:
         """Retourne les statistiques du cache."""
         return {
             'total_keys': len(self.cache),
-            'memory_usage_estimate': sum(len(str(v[0])) for v in self.cache.values())
+            'memory_usage_estimate': self._size_estimate
         }
 
-def cache_result(cache_manager: CacheManager, key_prefix: str = "", ttl: int = None):
-    """Décorateur pour mettre en cache les résultats de fonctions."""
+_PRIMITIVE_TYPES = (int, float, str, bool, type(None))
+
+def _is_method(func) -> bool:
+    """Indique si la fonction décorée reçoit l'instance (ou la classe) en premier argument."""
+    try:
+        first = next(iter(inspect.signature(func).parameters), None)
+    except (TypeError, ValueError):
+        return False
+    return first in ('self', 'cls')
+
+def _make_cache_key(key_prefix: str, func, args: tuple, kwargs: dict,
+                    is_method: bool = False) -> str:
+    """Construit une clé de cache stable d'un processus à l'autre.
+    
+    Pour une méthode, l'instance est remplacée par le nom de sa classe : son
+    adresse mémoire changerait d'un processus à l'autre.
+    """
+    name = func.__qualname__
+    if is_method and args:
+        owner = args[0] if isinstance(args[0], type) else type(args[0])
+        name = f"{owner.__qualname__}.{func.__name__}"
+        args = args[1:]
+    items = tuple(sorted(kwargs.items()))
+    
+    # Cas courant : arguments simples, la représentation suffit
+    if all(isinstance(a, _PRIMITIVE_TYPES) for a in args) and \
+            all(isinstance(v, _PRIMITIVE_TYPES) for _, v in items):
+        return f"{key_prefix}:{name}:{args}:{items}"
+    
+    try:
+        payload = pickle.dumps((args, items), protocol=5)
+    except Exception:
+        # Objets non sérialisables (verrous, connexions...) : repli sur leur représentation
+        payload = repr((args, items)).encode('utf-8')
+    
+    digest = hashlib.blake2b(payload, digest_size=8).hexdigest()
+    return f"{key_prefix}:{name}:{digest}"
+
+def cache_result(cache_manager: CacheManager, key_prefix: str = "", ttl: int = None,
+                 cache_none: bool = False):
+    """Décorateur pour mettre en cache les résultats de fonctions.
+    
+    Par défaut, les résultats None ou vides (dict/list), typiques des chemins
+    d'erreur, ne sont pas mis en cache pour ne pas figer un échec passager.
+    """
     def decorator(func):
+        is_method = _is_method(func)
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
             # Créer une clé unique basée sur la fonction et ses arguments
-            cache_key = f"{key_prefix}:{func.__name__}:{hash(str(args) + str(sorted(kwargs.items())))}"
+            cache_key = _make_cache_key(key_prefix, func, args, kwargs, is_method)
             
             # Vérifier le cache
             cached_result = cache_manager.get(cache_key)
@@ -82,6 +180,8 @@ def cache_result(cache_manager: CacheManager, key_prefix: str = "", ttl: int = N
             
             # Exécuter la fonction et mettre en cache
             result = func(*args, **kwargs)
+            if not cache_none and (result is None or (isinstance(result, (dict, list)) and not result)):
+                return result
             cache_manager.set(cache_key, result, ttl)
             return result
         
@@ -1,9 +1,10 @@
 
 import logging
 import json
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from database import DatabaseManager
+from cache_manager import global_cache
+from config import CHALLENGE_EXPIRY_HOURS
 from enum import Enum
 
 logger = logging.getLogger(__name__)
@@ -14,15 +15,115 @@ class ChallengeStatus(Enum):
     COMPLETED = "completed"
     EXPIRED = "expired"
 
+# Valeurs des statuts résolues une fois pour toutes
+_PENDING = ChallengeStatus.PENDING.value
+_ACCEPTED = ChallengeStatus.ACCEPTED.value
+_COMPLETED = ChallengeStatus.COMPLETED.value
+_EXPIRED = ChallengeStatus.EXPIRED.value
+
+# Durée de vie du texte de menu des défis mis en cache (secondes)
+_DISPLAY_TTL = 15
+
+# Requêtes du chemin chaud, partagées pour profiter du cache de requêtes préparées
+_SQL_CHALLENGE_TARGET = """
+    SELECT challenge_type, target_questions, parameters FROM user_challenges WHERE id = ?
+"""
+
+# Expiration calculée par SQLite, en heure locale comme les comparaisons ci-dessous
+_SQL_INSERT_CHALLENGE = f"""
+    INSERT INTO user_challenges
+    (challenger_id, challenged_id, challenge_type, parameters, target_questions, status, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime', '+{int(CHALLENGE_EXPIRY_HOURS)} hours'))
+"""
+
+_SQL_ACCEPT_CHALLENGE = """
+    UPDATE user_challenges SET status = ?
+    WHERE id = ? AND challenged_id = ? AND status = ?
+      AND expires_at > datetime('now', 'localtime')
+    RETURNING challenge_type, target_questions, parameters, challenger_id
+"""
+
+_SQL_EXPIRE_CHALLENGE = """
+    UPDATE user_challenges SET status = ?
+    WHERE id = ? AND challenged_id = ? AND status = ?
+      AND expires_at <= datetime('now', 'localtime')
+    RETURNING challenger_id
+"""
+
+_SQL_SWEEP_EXPIRED = """
+    UPDATE user_challenges SET status = ?
+    WHERE status = ? AND expires_at <= datetime('now', 'localtime')
+    RETURNING id
+"""
+
+_SQL_UPSERT_PROGRESS = """
+    INSERT INTO challenge_results
+    (challenge_id, user_id, questions_answered, correct_answers, stars_earned)
+    VALUES (?, ?, 1, ?, ?)
+    ON CONFLICT(challenge_id, user_id) DO UPDATE SET
+        questions_answered = questions_answered + 1,
+        correct_answers = correct_answers + excluded.correct_answers,
+        stars_earned = stars_earned + excluded.stars_earned
+    RETURNING questions_answered
+"""
+
+_SQL_CHALLENGE_STATE = """
+    SELECT challenge_type, target_questions, parameters, challenger_id, challenged_id, status, event_seq
+    FROM user_challenges WHERE id = ?
+"""
+
+_SQL_CHALLENGE_RESULTS = """
+    SELECT user_id, questions_answered, correct_answers, stars_earned
+    FROM challenge_results WHERE challenge_id = ?
+"""
+
+_SQL_COMPLETE_CHALLENGE = """
+    UPDATE user_challenges
+    SET status = ?, completed_at = CURRENT_TIMESTAMP, winner_id = ?,
+        event_seq = event_seq + 1
+    WHERE id = ? AND event_seq = ? AND status = ?
+"""
+
+def _target_questions(target_questions: Optional[int], params_json: str) -> int:
+    """Nombre de questions visé : colonne dédiée, sinon JSON des paramètres (anciens défis)."""
+    if target_questions is not None:
+        return target_questions
+    return json.loads(params_json).get('target_questions', 10)
+
 class ChallengeManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
+        # Paramètres de fin des défis connus : {challenge_id: (challenge_type, target_questions)}
+        self._challenge_targets: Dict[int, Tuple[str, int]] = {}
         self._init_challenge_tables()
     
+    def _remember_challenge(self, challenge_id: int, challenge_type: str, target_questions: int):
+        """Mémorise ce qu'il faut pour savoir quand un défi peut se terminer."""
+        self._challenge_targets[challenge_id] = (challenge_type, target_questions)
+    
+    def _get_challenge_target(self, challenge_id: int) -> Optional[Tuple[str, int]]:
+        """Retourne (type, nombre de questions visé) d'un défi, chargé depuis la base si besoin."""
+        target = self._challenge_targets.get(challenge_id)
+        if target is None:
+            with self.db.read_conn() as conn:
+                row = conn.execute(_SQL_CHALLENGE_TARGET, (challenge_id,)).fetchone()
+            if row is None:
+                return None
+            self._remember_challenge(challenge_id, row[0], _target_questions(row[1], row[2]))
+            target = self._challenge_targets[challenge_id]
+        return target
+    
+    def _invalidate_display(self, *user_ids: int):
+        """Invalide le menu des défis mis en cache pour ces utilisateurs."""
+        for user_id in user_ids:
+            global_cache.delete(f"challenge_display:{user_id}")
+    
     def _init_challenge_tables(self):
         """Initialise les tables des défis."""
         try:
-            with self.db.connection() as conn:
+            # Tables, migrations et index dans la même transaction de la connexion
+            # d'écriture (BEGIN IMMEDIATE ... COMMIT) : un seul commit au démarrage
+            with self.db.write_conn() as conn:
                 cursor = conn.cursor()
                 
                 # Table des défis
@@ -33,17 +134,32 @@ class ChallengeManager:
                         challenged_id INTEGER,
                         challenge_type TEXT,
                         parameters TEXT,
+                        target_questions INTEGER,
                         status TEXT,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         expires_at TIMESTAMP,
                         completed_at TIMESTAMP,
                         winner_id INTEGER,
+                        event_seq INTEGER NOT NULL DEFAULT 0,
                         FOREIGN KEY (challenger_id) REFERENCES user_scores (user_id),
                         FOREIGN KEY (challenged_id) REFERENCES user_scores (user_id),
                         FOREIGN KEY (winner_id) REFERENCES user_scores (user_id)
                     )
                 """)
                 
+                # Bases existantes : ajouter le numéro de version utilisé pour la clôture
+                # et l'objectif de questions extrait du JSON des paramètres
+                cursor.execute("PRAGMA table_info(user_challenges)")
+                columns = {row[1] for row in cursor.fetchall()}
+                if 'event_seq' not in columns:
+                    cursor.execute("ALTER TABLE user_challenges ADD COLUMN event_seq INTEGER NOT NULL DEFAULT 0")
+                if 'target_questions' not in columns:
+                    cursor.execute("ALTER TABLE user_challenges ADD COLUMN target_questions INTEGER")
+                    cursor.execute("""
+                        UPDATE user_challenges
+                        SET target_questions = json_extract(parameters, '$.target_questions')
+                    """)
+                
                 # Table des résultats de défi
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS challenge_results (
@@ -54,12 +170,38 @@ class ChallengeManager:
                         correct_answers INTEGER DEFAULT 0,
                         stars_earned INTEGER DEFAULT 0,
                         completion_time INTEGER,
+                        UNIQUE(challenge_id, user_id),
                         FOREIGN KEY (challenge_id) REFERENCES user_challenges (id),
                         FOREIGN KEY (user_id) REFERENCES user_scores (user_id)
                     )
                 """)
                 
-                conn.commit()
+                # Bases existantes : dédoublonner puis garantir l'unicité requise par l'UPSERT
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_cr_chal_user'")
+                if cursor.fetchone() is None:
+                    cursor.execute("""
+                        DELETE FROM challenge_results WHERE id NOT IN (
+                            SELECT MIN(id) FROM challenge_results GROUP BY challenge_id, user_id
+                        )
+                    """)
+                    cursor.execute("""
+                        CREATE UNIQUE INDEX IF NOT EXISTS idx_cr_chal_user
+                        ON challenge_results(challenge_id, user_id)
+                    """)
+                
+                # Index des filtres fréquents (défis d'un joueur par statut, expiration)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_uc_challenger_status
+                    ON user_challenges(challenger_id, status, created_at DESC)
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_uc_challenged_status
+                    ON user_challenges(challenged_id, status, created_at DESC)
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_uc_expires_pending
+                    ON user_challenges(expires_at) WHERE status = 'pending'
+                """)
         except Exception as e:
             logger.error(f"Erreur initialisation tables défis: {e}")
     
@@ -70,22 +212,21 @@ class ChallengeManager:
             if challenger_id == challenged_id:
                 return None
             
-            expires_at = datetime.now() + timedelta(hours=24)  # Expire dans 24h
-            
-            with self.db.connection() as conn:
+            with self.db.write_conn() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO user_challenges 
-                    (challenger_id, challenged_id, challenge_type, parameters, status, expires_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (challenger_id, challenged_id, challenge_type, 
-                     json.dumps(parameters), ChallengeStatus.PENDING.value, expires_at))
+                cursor.execute(_SQL_INSERT_CHALLENGE, (challenger_id, challenged_id, challenge_type,
+                                                       json.dumps(parameters), parameters.get('target_questions'),
+                                                       _PENDING))
                 
                 challenge_id = cursor.lastrowid
-                conn.commit()
-                
-                logger.info(f"Défi créé: {challenge_id} entre {challenger_id} et {challenged_id}")
-                return challenge_id
+            
+            # Mémoriser le défi et invalider les menus une fois la transaction validée
+            self._remember_challenge(challenge_id, challenge_type,
+                                     parameters.get('target_questions', 10))
+            self._invalidate_display(challenger_id, challenged_id)
+            
+            logger.info(f"Défi créé: {challenge_id} entre {challenger_id} et {challenged_id}")
+            return challenge_id
                 
         except Exception as e:
             logger.error(f"Erreur création défi: {e}")
@@ -94,78 +235,69 @@ class ChallengeManager:
     def accept_challenge(self, challenge_id: int, user_id: int) -> bool:
         """Accepte un défi."""
         try:
-            with self.db.connection() as conn:
+            with self.db.write_conn() as conn:
                 cursor = conn.cursor()
                 
-                # Vérifier que l'utilisateur peut accepter ce défi
-                cursor.execute("""
-                    SELECT challenged_id, status, expires_at FROM user_challenges 
-                    WHERE id = ? AND challenged_id = ? AND status = ?
-                """, (challenge_id, user_id, ChallengeStatus.PENDING.value))
-                
-                result = cursor.fetchone()
-                if not result:
-                    return False
-                
-                expires_at = datetime.strptime(result[2], '%Y-%m-%d %H:%M:%S')
-                if datetime.now() > expires_at:
-                    # Défi expiré
-                    cursor.execute("""
-                        UPDATE user_challenges SET status = ? WHERE id = ?
-                    """, (ChallengeStatus.EXPIRED.value, challenge_id))
-                    conn.commit()
-                    return False
-                
-                # Accepter le défi
-                cursor.execute("""
-                    UPDATE user_challenges SET status = ? WHERE id = ?
-                """, (ChallengeStatus.ACCEPTED.value, challenge_id))
-                
-                conn.commit()
-                return True
+                # Accepter uniquement un défi en attente, destiné à l'utilisateur et non expiré
+                # (expires_at est stocké en heure locale par create_challenge)
+                cursor.execute(_SQL_ACCEPT_CHALLENGE, (_ACCEPTED, challenge_id, user_id, _PENDING))
+                accepted = cursor.fetchone()
+                if accepted is None:
+                    # Échec : marquer le défi comme expiré s'il l'est
+                    cursor.execute(_SQL_EXPIRE_CHALLENGE, (_EXPIRED, challenge_id, user_id, _PENDING))
+                    expired = cursor.fetchone()
+            
+            # Invalider les menus une fois la transaction validée
+            if accepted is None:
+                if expired is not None:
+                    self._challenge_targets.pop(challenge_id, None)
+                    self._invalidate_display(expired[0], user_id)
+                return False
+            
+            self._remember_challenge(challenge_id, accepted[0],
+                                     _target_questions(accepted[1], accepted[2]))
+            self._invalidate_display(accepted[3], user_id)
+            return True
                 
         except Exception as e:
             logger.error(f"Erreur acceptation défi {challenge_id}: {e}")
             return False
     
+    def sweep_expired(self) -> int:
+        """Marque en une requête tous les défis en attente arrivés à expiration."""
+        try:
+            with self.db.write_conn() as conn:
+                expired_ids = [row[0] for row in conn.execute(_SQL_SWEEP_EXPIRED, (_EXPIRED, _PENDING))]
+            expired = len(expired_ids)
+            
+            # Défis terminés : leurs paramètres de fin ne serviront plus
+            for challenge_id in expired_ids:
+                self._challenge_targets.pop(challenge_id, None)
+            
+            if expired:
+                global_cache.delete_prefix("challenge_display:")
+                logger.info(f"{expired} défi(s) expiré(s)")
+            return expired
+            
+        except Exception as e:
+            logger.error(f"Erreur expiration des défis: {e}")
+            return 0
+    
     def update_challenge_progress(self, challenge_id: int, user_id: int, 
                                 is_correct: bool, stars_earned: int):
         """Met à jour le progrès d'un utilisateur dans un défi."""
         try:
-            with self.db.connection() as conn:
+            with self.db.write_conn() as conn:
                 cursor = conn.cursor()
                 
-                # Vérifier si l'entrée existe
-                cursor.execute("""
-                    SELECT questions_answered, correct_answers, stars_earned 
-                    FROM challenge_results 
-                    WHERE challenge_id = ? AND user_id = ?
-                """, (challenge_id, user_id))
-                
-                result = cursor.fetchone()
-                
-                if result:
-                    # Mettre à jour
-                    new_questions = result[0] + 1
-                    new_correct = result[1] + (1 if is_correct else 0)
-                    new_stars = result[2] + stars_earned
-                    
-                    cursor.execute("""
-                        UPDATE challenge_results 
-                        SET questions_answered = ?, correct_answers = ?, stars_earned = ?
-                        WHERE challenge_id = ? AND user_id = ?
-                    """, (new_questions, new_correct, new_stars, challenge_id, user_id))
-                else:
-                    # Créer nouvelle entrée
-                    cursor.execute("""
-                        INSERT INTO challenge_results 
-                        (challenge_id, user_id, questions_answered, correct_answers, stars_earned)
-                        VALUES (?, ?, 1, ?, ?)
-                    """, (challenge_id, user_id, 1 if is_correct else 0, stars_earned))
-                
-                conn.commit()
-                
-                # Vérifier si le défi est terminé
+                # Incrément atomique : pas de lecture préalable, pas de mise à jour perdue
+                cursor.execute(_SQL_UPSERT_PROGRESS, (challenge_id, user_id, 1 if is_correct else 0, stars_earned))
+                questions_answered = cursor.fetchone()[0]
+            
+            # Ne vérifier la fin du défi (hors de la connexion d'écriture) que si
+            # ce joueur vient d'atteindre l'objectif
+            target = self._get_challenge_target(challenge_id)
+            if target is not None and target[0] == "quiz_race" and questions_answered >= target[1]:
                 self._check_challenge_completion(challenge_id)
                 
         except Exception as e:
@@ -174,105 +306,114 @@ class ChallengeManager:
     def _check_challenge_completion(self, challenge_id: int):
         """Vérifie si un défi est terminé et détermine le gagnant."""
         try:
-            with self.db.connection() as conn:
+            with self.db.read_conn() as conn:
                 cursor = conn.cursor()
                 
                 # Récupérer les paramètres du défi
-                cursor.execute("""
-                    SELECT challenge_type, parameters, challenger_id, challenged_id, status
-                    FROM user_challenges WHERE id = ?
-                """, (challenge_id,))
+                cursor.execute(_SQL_CHALLENGE_STATE, (challenge_id,))
                 
                 challenge_data = cursor.fetchone()
-                if not challenge_data or challenge_data[4] != ChallengeStatus.ACCEPTED.value:
+                if not challenge_data or challenge_data[5] != _ACCEPTED:
                     return
                 
-                challenge_type, params_json, challenger_id, challenged_id, status = challenge_data
-                parameters = json.loads(params_json)
+                (challenge_type, target_questions, params_json,
+                 challenger_id, challenged_id, status, event_seq) = challenge_data
                 
                 # Récupérer les résultats des deux participants
-                cursor.execute("""
-                    SELECT user_id, questions_answered, correct_answers, stars_earned
-                    FROM challenge_results WHERE challenge_id = ?
-                """, (challenge_id,))
+                cursor.execute(_SQL_CHALLENGE_RESULTS, (challenge_id,))
                 
                 results = cursor.fetchall()
                 user_results = {result[0]: result[1:] for result in results}
-                
-                # Vérifier les conditions de fin selon le type de défi
-                if challenge_type == "quiz_race":
-                    target_questions = parameters.get('target_questions', 10)
+            
+            # Vérifier les conditions de fin selon le type de défi
+            if challenge_type == "quiz_race":
+                target_questions = _target_questions(target_questions, params_json)
+                
+                # Vérifier si les deux ont terminé
+                challenger_done = challenger_id in user_results and user_results[challenger_id][0] >= target_questions
+                challenged_done = challenged_id in user_results and user_results[challenged_id][0] >= target_questions
+                
+                if challenger_done and challenged_done:
+                    # Déterminer le gagnant (plus d'étoiles)
+                    challenger_stars = user_results.get(challenger_id, (0,0,0))[2]
+                    challenged_stars = user_results.get(challenged_id, (0,0,0))[2]
+                    
+                    winner_id = challenger_id if challenger_stars > challenged_stars else challenged_id
+                    if challenger_stars == challenged_stars:
+                        winner_id = None  # Égalité
                     
-                    # Vérifier si les deux ont terminé
-                    challenger_done = challenger_id in user_results and user_results[challenger_id][0] >= target_questions
-                    challenged_done = challenged_id in user_results and user_results[challenged_id][0] >= target_questions
+                    # Marquer comme terminé, seulement si personne ne l'a fait entre-temps
+                    with self.db.write_conn() as conn:
+                        cursor = conn.execute(_SQL_COMPLETE_CHALLENGE, (
+                            _COMPLETED, winner_id, challenge_id, event_seq, _ACCEPTED))
+                        if cursor.rowcount == 0:
+                            return  # Déjà clôturé par un autre traitement
                     
-                    if challenger_done and challenged_done:
-                        # Déterminer le gagnant (plus d'étoiles)
-                        challenger_stars = user_results.get(challenger_id, (0,0,0))[2]
-                        challenged_stars = user_results.get(challenged_id, (0,0,0))[2]
-                        
-                        winner_id = challenger_id if challenger_stars > challenged_stars else challenged_id
-                        if challenger_stars == challenged_stars:
-                            winner_id = None  # Égalité
-                        
-                        # Marquer comme terminé
-                        cursor.execute("""
-                            UPDATE user_challenges 
-                            SET status = ?, completed_at = CURRENT_TIMESTAMP, winner_id = ?
-                            WHERE id = ?
-                        """, (ChallengeStatus.COMPLETED.value, winner_id, challenge_id))
-                        
-                        conn.commit()
-                        
-                        logger.info(f"Défi {challenge_id} terminé, gagnant: {winner_id}")
+                    self._challenge_targets.pop(challenge_id, None)
+                    self._invalidate_display(challenger_id, challenged_id)
+                    
+                    logger.info(f"Défi {challenge_id} terminé, gagnant: {winner_id}")
                 
         except Exception as e:
             logger.error(f"Erreur vérification fin défi {challenge_id}: {e}")
     
-    def get_user_challenges(self, user_id: int, status_filter: str = None) -> List[Dict]:
-        """Récupère les défis d'un utilisateur."""
+    def get_user_challenges(self, user_id: int, status_filter: str = None,
+                            parse_parameters: bool = True) -> List[Dict]:
+        """Récupère les défis d'un utilisateur.
+        
+        Avec parse_parameters=False, 'parameters' reste la chaîne JSON brute.
+        """
+        return self.get_user_challenges_bulk(user_id, [status_filter] if status_filter else None,
+                                             parse_parameters=parse_parameters)
+    
+    def get_user_challenges_bulk(self, user_id: int, statuses: Optional[List[str]] = None,
+                                 parse_parameters: bool = True) -> List[Dict]:
+        """Récupère en une requête les défis d'un utilisateur pour plusieurs statuts."""
         try:
-            with self.db.connection() as conn:
+            with self.db.read_conn() as conn:
                 cursor = conn.cursor()
                 
                 query = """
                     SELECT c.id, c.challenger_id, c.challenged_id, c.challenge_type, 
-                           c.parameters, c.status, c.created_at, c.expires_at, c.winner_id,
-                           u1.name as challenger_name, u2.name as challenged_name
+                           c.parameters, c.status, c.created_at, c.expires_at, c.winner_id
                     FROM user_challenges c
-                    JOIN user_scores u1 ON c.challenger_id = u1.user_id
-                    JOIN user_scores u2 ON c.challenged_id = u2.user_id
                     WHERE (c.challenger_id = ? OR c.challenged_id = ?)
                 """
                 
                 params = [user_id, user_id]
                 
-                if status_filter:
-                    query += " AND c.status = ?"
-                    params.append(status_filter)
+                if statuses:
+                    query += f" AND c.status IN ({','.join('?' * len(statuses))})"
+                    params.extend(statuses)
                 
                 query += " ORDER BY c.created_at DESC"
                 
                 cursor.execute(query, params)
                 results = cursor.fetchall()
+                if not results:
+                    return []
+                
+                # Noms des participants : une seule requête pour les joueurs distincts
+                player_ids = {row['challenger_id'] for row in results} | {row['challenged_id'] for row in results}
+                cursor.execute(f"""
+                    SELECT user_id, name FROM user_scores
+                    WHERE user_id IN ({','.join('?' * len(player_ids))})
+                """, tuple(player_ids))
+                names = {row['user_id']: row['name'] for row in cursor.fetchall()}
                 
                 challenges = []
-                for result in results:
-                    challenges.append({
-                        'id': result[0],
-                        'challenger_id': result[1],
-                        'challenged_id': result[2],
-                        'challenge_type': result[3],
-                        'parameters': json.loads(result[4]),
-                        'status': result[5],
-                        'created_at': result[6],
-                        'expires_at': result[7],
-                        'winner_id': result[8],
-                        'challenger_name': result[9],
-                        'challenged_name': result[10],
-                        'is_challenger': user_id == result[1]
-                    })
+                for row in results:
+                    challenger_id, challenged_id = row['challenger_id'], row['challenged_id']
+                    # Comme l'ancienne jointure : ignorer les défis dont un joueur est inconnu
+                    if challenger_id not in names or challenged_id not in names:
+                        continue
+                    challenge = dict(row)
+                    if parse_parameters:
+                        challenge['parameters'] = json.loads(challenge['parameters'])
+                    challenge['challenger_name'] = names[challenger_id]
+                    challenge['challenged_name'] = names[challenged_id]
+                    challenge['is_challenger'] = user_id == challenger_id
+                    challenges.append(challenge)
                 
                 return challenges
                 
@@ -282,9 +423,22 @@ class ChallengeManager:
     
     def get_challenge_display_text(self, user_id: int) -> str:
         """Génère le texte d'affichage des défis pour un utilisateur."""
-        pending_challenges = self.get_user_challenges(user_id, ChallengeStatus.PENDING.value)
-        active_challenges = self.get_user_challenges(user_id, ChallengeStatus.ACCEPTED.value)
-        completed_challenges = self.get_user_challenges(user_id, ChallengeStatus.COMPLETED.value)[-5:]  # 5 derniers
+        cache_key = f"challenge_display:{user_id}"
+        cached_text = global_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+        
+        buckets = {
+            _PENDING: [],
+            _ACCEPTED: [],
+            _COMPLETED: []
+        }
+        for challenge in self.get_user_challenges_bulk(user_id, list(buckets), parse_parameters=False):
+            buckets[challenge['status']].append(challenge)
+        
+        pending_challenges = buckets[_PENDING]
+        active_challenges = buckets[_ACCEPTED]
+        completed_challenges = buckets[_COMPLETED][-5:]  # 5 derniers
         
         text = "⚔️ **VOS DÉFIS** ⚔️\n\n"
         
@@ -322,4 +476,5 @@ class ChallengeManager:
             text += "Aucun défi en cours.\n\n"
             text += "💡 Créez un défi avec /challenge @utilisateur"
         
+        global_cache.set(cache_key, text, ttl=_DISPLAY_TTL)
         return text
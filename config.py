@@ -1,5 +1,7 @@
 
 import os
+import re
+from types import MappingProxyType
 from datetime import time
 
 # Configuration du Bot Telegram Éducatif
@@ -36,6 +38,15 @@ SPAM_KEYWORDS = [
     "https://"
 ]
 
+def compile_spam_keywords(keywords) -> "re.Pattern":
+    """Compile les mots-clés de spam en une seule expression (un seul parcours du message)."""
+    if not keywords:
+        return re.compile(r'(?!)')  # Ne correspond à rien
+    return re.compile('|'.join(re.escape(k) for k in keywords), re.IGNORECASE)
+
+# Expression précompilée au chargement, à réutiliser pour chaque message
+SPAM_KEYWORDS_RE = compile_spam_keywords(SPAM_KEYWORDS)
+
 # Configuration des points
 POINTS_PER_CORRECT_ANSWER = 5
 
@@ -46,7 +57,7 @@ WELCOME_MESSAGE = (
 )
 
 # Messages du système
-MESSAGES = {
+MESSAGES = MappingProxyType({
     "menu_title": "🎓 **MENU PRINCIPAL - BOT ÉDUCATIF**\n\n📚 Choisissez une option ci-dessous :",
     "quiz_launched": "🎯 Quiz lancé !",
     "admin_only": "❌ Cette fonction est réservée aux administrateurs en groupe.",
@@ -55,15 +66,22 @@ MESSAGES = {
     "spam_detected": "🚫 Message supprimé pour spam.",
     "user_banned": "🚫 {username} a été banni pour spam répété.",
     "warning_message": "⚠️ {username}, message supprimé pour spam.\nAvertissement {warning_count}/3. Encore {remaining} avant bannissement."
-}
+})
 
 # Configuration du logging
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
+# Durée de validité d'un défi en attente (heures)
+CHALLENGE_EXPIRY_HOURS = 24
+
 # Configuration des nettoyages automatiques
 CLEANUP_OLD_DATA_DAYS = 30  # Supprimer les données de plus de 30 jours
 
+# Recherche plein texte (FTS5) dans les questions répondues ; désactivée, aucun
+# index ni trigger n'est maintenu et search_grades() se replie sur LIKE
+ENABLE_QUESTION_SEARCH = False
+
 # Questions par défaut (chemin vers le fichier JSON)
 QUESTIONS_FILE = "questions.json"
 
@@ -85,3 +103,6 @@ QUIZ_THEMES = {
         'description': 'Mix Histoire et Géographie (mode classique)'
     }
 }
+
+# Gabarits en lecture seule : évite toute modification accidentelle à l'exécution
+QUIZ_THEMES = MappingProxyType({key: MappingProxyType(theme) for key, theme in QUIZ_THEMES.items()})
@@ -1,23 +1,253 @@
 
+import atexit
+import os
 import sqlite3
 import json
 import logging
+import threading
+from contextlib import closing, contextmanager
+from itertools import groupby
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+from cache_manager import global_cache
+from config import ENABLE_QUESTION_SEARCH
 
 logger = logging.getLogger(__name__)
 
+# Sérialisation compacte de question_data : encodeur/décodeur construits une seule fois
+# (json.dumps avec options en recrée un à chaque appel), sans espaces ni échappement
+# \uXXXX des accents ; les lignes existantes restent lisibles
+_encode_question = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+_decode_question = json.JSONDecoder().decode
+
+# Scores mis en cache en mémoire (classements et profils relisent les mêmes lignes)
+_SCORE_CACHE_TTL = 300
+_ALL_SCORES_CACHE_KEY = "user_scores:all"
+
+# Écritures différées : regroupées en une transaction toutes les 50 ms ou par 100
+_WRITE_BATCH_DELAY = 0.05
+_WRITE_BATCH_SIZE = 100
+
+# Requêtes du chemin chaud : chaînes partagées pour maximiser les hits du cache de requêtes préparées
+_SQL_GET_USER_SCORE = """
+    SELECT name, correct, total, stars 
+    FROM user_scores WHERE user_id = ?
+"""
+
+# Mise à jour en place (pas de DELETE + INSERT comme OR REPLACE) : created_at est conservé
+_SQL_UPSERT_USER_SCORE = """
+    INSERT INTO user_scores (user_id, name, correct, total, stars, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, unixepoch(), unixepoch())
+    ON CONFLICT(user_id) DO UPDATE SET
+        name = excluded.name,
+        correct = excluded.correct,
+        total = excluded.total,
+        stars = excluded.stars,
+        updated_at = unixepoch()
+"""
+
+_SQL_GET_USER_WARNINGS = "SELECT warning_count FROM user_warnings WHERE user_id = ?"
+
+_SQL_UPSERT_USER_WARNINGS = """
+    INSERT INTO user_warnings (user_id, warning_count, updated_at)
+    VALUES (?, ?, unixepoch())
+    ON CONFLICT(user_id) DO UPDATE SET
+        warning_count = excluded.warning_count,
+        updated_at = unixepoch()
+"""
+
+_SQL_INSERT_USER_GRADE = """
+    INSERT INTO user_grades (user_id, question, is_correct, stars_earned, answered_at_ts)
+    VALUES (?, ?, ?, ?, unixepoch())
+"""
+
+_SQL_UPSERT_ACTIVE_POLL = """
+    INSERT OR REPLACE INTO active_polls 
+    (poll_id, question_data, chat_id, message_id, question, session_id, question_number, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, unixepoch())
+"""
+
+_SQL_GET_ACTIVE_POLL = """
+    SELECT question_data, chat_id, message_id, question, session_id, question_number
+    FROM active_polls WHERE poll_id = ?
+"""
+
+_SQL_ADD_PARTICIPANT = """
+    INSERT OR IGNORE INTO daily_quiz_participants (session_id, user_id)
+    SELECT ?, ? WHERE EXISTS (SELECT 1 FROM daily_quiz_sessions WHERE session_id = ?)
+"""
+
+_SQL_GET_PARTICIPANTS = "SELECT user_id FROM daily_quiz_participants WHERE session_id = ?"
+
+_SQL_DELETE_ORPHAN_PARTICIPANTS = """
+    DELETE FROM daily_quiz_participants
+    WHERE session_id NOT IN (SELECT session_id FROM daily_quiz_sessions)
+"""
+
+class ConnectionPool:
+    """Pool de connexions SQLite persistantes : un écrivain sérialisé et un lecteur par thread."""
+    
+    def __init__(self, factory: Callable[[], sqlite3.Connection]):
+        self._factory = factory
+        # Lecteur propre à chaque thread : aucune file ni verrou sur le chemin de lecture
+        self._local = threading.local()
+        self._readers = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._write_owner = None
+    
+    def _thread_reader(self) -> sqlite3.Connection:
+        """Retourne le lecteur du thread courant, ouvert au premier usage."""
+        local = self._local
+        if getattr(local, 'generation', None) == self._generation:
+            return local.conn
+        
+        conn = self._factory()
+        # Lecteur en lecture seule : une écriture égarée échoue au lieu de
+        # contourner l'écrivain sérialisé (et de valider ligne par ligne)
+        conn.execute("PRAGMA query_only=ON")
+        with self._lock:
+            # Fermer au passage les lecteurs des threads terminés
+            alive = {thread.ident for thread in threading.enumerate()}
+            for ident in [ident for ident in self._readers if ident not in alive]:
+                self._readers.pop(ident).close()
+            self._readers[threading.get_ident()] = conn
+            local.conn = conn
+            local.generation = self._generation
+        return conn
+    
+    def _owns_writer(self) -> bool:
+        """Indique si le thread courant est dans un bloc writer()."""
+        return self._write_owner == threading.get_ident()
+    
+    @contextmanager
+    def reader(self):
+        """Prête la connexion de lecture du thread courant."""
+        if self._owns_writer():
+            # Lecture au sein d'une transaction : voir ses propres écritures non validées
+            yield self._writer
+            return
+        
+        conn = self._thread_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+    
+    @contextmanager
+    def writer(self):
+        """Prête l'unique connexion d'écriture ; commit à la sortie, rollback en cas d'erreur.
+        
+        Réentrant : un bloc imbriqué rejoint la transaction englobante via un
+        SAVEPOINT, seul le bloc le plus externe valide.
+        """
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._factory()
+            conn = self._writer
+            
+            if self._write_depth:
+                savepoint = f"sp{self._write_depth}"
+                conn.execute(f"SAVEPOINT {savepoint}")
+                self._write_depth += 1
+                try:
+                    yield conn
+                    conn.execute(f"RELEASE {savepoint}")
+                except Exception:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    conn.execute(f"RELEASE {savepoint}")
+                    raise
+                finally:
+                    self._write_depth -= 1
+                return
+            
+            # Prendre le verrou d'écriture dès le début plutôt qu'au premier UPDATE
+            conn.execute("BEGIN IMMEDIATE")
+            self._write_depth = 1
+            self._write_owner = threading.get_ident()
+            try:
+                yield conn
+                if conn.in_transaction:
+                    conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                self._write_depth = 0
+                self._write_owner = None
+    
+    def close(self):
+        """Ferme toutes les connexions ouvertes par le pool."""
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._lock:
+            for conn in self._readers.values():
+                conn.close()
+            self._readers.clear()
+            # Les lecteurs encore référencés par d'autres threads seront rouverts
+            self._generation += 1
+
 class DatabaseManager:
     def __init__(self, db_path: str = "bot_data.db"):
         self.db_path = db_path
         self.init_database()
+        self.pool = ConnectionPool(self._connect_autocommit)
+        # File des écritures différées (sql, paramètres), dans l'ordre d'arrivée
+        self._pending_writes = []
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+        atexit.register(self.flush)
+    
+    def _connect(self, isolation_level: Optional[str] = "") -> sqlite3.Connection:
+        """Ouvre une connexion configurée (cache de requêtes préparées, PRAGMA)."""
+        # check_same_thread=False : les connexions du pool passent d'un thread à l'autre
+        conn = sqlite3.connect(self.db_path, cached_statements=512, check_same_thread=False,
+                               isolation_level=isolation_level)
+        self._configure(conn)
+        return conn
+    
+    @staticmethod
+    def _configure(conn: sqlite3.Connection):
+        """Applique les PRAGMA propres à chaque connexion."""
+        # Le mode WAL est persistant, mais ces réglages doivent être refaits à chaque connexion
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+    
+    def _connect_autocommit(self) -> sqlite3.Connection:
+        """Connexion du pool : pas de BEGIN implicite, les transactions sont explicites."""
+        conn = self._connect(isolation_level=None)
+        # Lignes accessibles par nom comme par position (compatibles avec les tuples)
+        conn.row_factory = sqlite3.Row
+        return conn
     
     def init_database(self):
         """Initialise la base de données avec les tables nécessaires."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
+                # Libération progressive des pages vides (effectif sur une base neuve,
+                # ou après un VACUUM sur une base existante)
+                cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                
+                # Journal WAL : les lecteurs ne bloquent plus les écritures et
+                # chaque commit coûte un seul fsync en mode synchronous=NORMAL
+                cursor.execute("PRAGMA journal_mode=WAL")
+                
+                # Tout le schéma dans une seule transaction (un seul commit au démarrage) ;
+                # sans BEGIN explicite, sqlite3 valide chaque CREATE séparément
+                cursor.execute("BEGIN")
+                
                 # Table des utilisateurs et leurs scores
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS user_scores (
@@ -26,8 +256,10 @@ class DatabaseManager:
                         correct INTEGER DEFAULT 0,
                         total INTEGER DEFAULT 0,
                         stars INTEGER DEFAULT 0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        recent_mask INTEGER DEFAULT 0,
+                        recent_count INTEGER DEFAULT 0,
+                        created_at INTEGER DEFAULT (unixepoch()),
+                        updated_at INTEGER DEFAULT (unixepoch())
                     )
                 """)
                 
@@ -36,7 +268,7 @@ class DatabaseManager:
                     CREATE TABLE IF NOT EXISTS user_warnings (
                         user_id INTEGER PRIMARY KEY,
                         warning_count INTEGER DEFAULT 0,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        updated_at INTEGER DEFAULT (unixepoch())
                     )
                 """)
                 
@@ -49,6 +281,7 @@ class DatabaseManager:
                         is_correct BOOLEAN,
                         stars_earned INTEGER,
                         answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        answered_at_ts INTEGER DEFAULT (unixepoch()),
                         FOREIGN KEY (user_id) REFERENCES user_scores (user_id)
                     )
                 """)
@@ -63,7 +296,7 @@ class DatabaseManager:
                         question TEXT,
                         session_id TEXT,
                         question_number INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        created_at INTEGER DEFAULT (unixepoch())
                     )
                 """)
                 
@@ -75,10 +308,38 @@ class DatabaseManager:
                         current_question INTEGER,
                         total_questions INTEGER,
                         participants TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        created_at INTEGER DEFAULT (unixepoch())
                     )
                 """)
                 
+                # Horodatages created_at/updated_at en secondes Unix (INTEGER) plutôt qu'en texte
+                self._migrate_epoch_timestamps(cursor)
+                
+                # Fenêtre glissante des 10 dernières réponses (bit 0 = la plus récente)
+                self._migrate_recent_mask(cursor)
+                
+                # Copie entière (secondes Unix) de answered_at pour les filtres par période
+                self._migrate_answered_at_ts(cursor)
+                
+                # Participants des sessions : une ligne par joueur plutôt qu'une liste JSON
+                # réécrite à chaque nouvelle réponse
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS daily_quiz_participants (
+                        session_id TEXT,
+                        user_id INTEGER,
+                        PRIMARY KEY (session_id, user_id)
+                    ) WITHOUT ROWID
+                """)
+                
+                # Reprise des anciennes listes JSON, vidées ensuite pour ne migrer qu'une fois
+                cursor.execute("""
+                    INSERT OR IGNORE INTO daily_quiz_participants (session_id, user_id)
+                    SELECT s.session_id, p.value
+                    FROM daily_quiz_sessions s, json_each(s.participants) p
+                    WHERE s.participants IS NOT NULL
+                """)
+                cursor.execute("UPDATE daily_quiz_sessions SET participants = NULL WHERE participants IS NOT NULL")
+                
                 # Table des badges utilisateur
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS user_badges (
@@ -104,31 +365,128 @@ class DatabaseManager:
                 # Créer les index pour optimiser les performances
                 self._create_indexes(cursor)
                 
+                # Tables d'agrégats alimentées par trigger
+                self._create_rollups(cursor)
+                
+                # Index plein texte optionnel sur les questions
+                self._create_question_search(cursor)
+                
                 conn.commit()
                 logger.info("Base de données initialisée avec succès")
                 
         except Exception as e:
             logger.error(f"Erreur initialisation base de données : {e}")
     
+    def _migrate_epoch_timestamps(self, cursor):
+        """Convertit une fois les horodatages texte hérités en secondes Unix.
+        
+        Les bases anciennes gardent leur DEFAULT CURRENT_TIMESTAMP : les requêtes
+        d'insertion renseignent donc ces colonnes explicitement avec unixepoch().
+        """
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= 1:
+            return
+        
+        for table, column in (('user_scores', 'created_at'), ('user_scores', 'updated_at'),
+                              ('user_warnings', 'updated_at'), ('active_polls', 'created_at'),
+                              ('daily_quiz_sessions', 'created_at')):
+            cursor.execute(f"""
+                UPDATE {table} SET {column} = unixepoch({column})
+                WHERE typeof({column}) = 'text'
+            """)
+        cursor.execute("PRAGMA user_version = 1")
+    
+    def _migrate_recent_mask(self, cursor):
+        """Ajoute user_scores.recent_mask et l'initialise depuis les 10 dernières notes."""
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= 2:
+            return
+        
+        cursor.execute("SELECT 1 FROM pragma_table_info('user_scores') WHERE name = 'recent_mask'")
+        if cursor.fetchone() is None:
+            cursor.execute("ALTER TABLE user_scores ADD COLUMN recent_mask INTEGER DEFAULT 0")
+        
+        cursor.execute("""
+            UPDATE user_scores SET recent_mask = (
+                SELECT COALESCE(SUM(CASE WHEN is_correct THEN 1 << (rn - 1) ELSE 0 END), 0)
+                FROM (
+                    SELECT is_correct,
+                           ROW_NUMBER() OVER (ORDER BY answered_at DESC, id DESC) as rn
+                    FROM user_grades g
+                    WHERE g.user_id = user_scores.user_id
+                )
+                WHERE rn <= 10
+            )
+        """)
+        cursor.execute("PRAGMA user_version = 2")
+    
+    def _migrate_answered_at_ts(self, cursor):
+        """Ajoute user_grades.answered_at_ts et le remplit depuis answered_at.
+        
+        ALTER TABLE n'accepte pas de DEFAULT non constant : l'insertion des notes
+        renseigne donc la colonne explicitement avec unixepoch().
+        """
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= 3:
+            return
+        
+        cursor.execute("SELECT 1 FROM pragma_table_info('user_grades') WHERE name = 'answered_at_ts'")
+        if cursor.fetchone() is None:
+            cursor.execute("ALTER TABLE user_grades ADD COLUMN answered_at_ts INTEGER")
+        
+        cursor.execute("""
+            UPDATE user_grades SET answered_at_ts = unixepoch(answered_at)
+            WHERE answered_at_ts IS NULL
+        """)
+        cursor.execute("PRAGMA user_version = 3")
+    
+    def _migrate_recent_count(self, cursor):
+        """Ajoute user_scores.recent_count (taille de la fenêtre recent_mask).
+        
+        L'ancien trigger de la fenêtre est supprimé pour être recréé avec le compteur.
+        """
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= 5:
+            return
+        
+        cursor.execute("SELECT 1 FROM pragma_table_info('user_scores') WHERE name = 'recent_count'")
+        if cursor.fetchone() is None:
+            cursor.execute("ALTER TABLE user_scores ADD COLUMN recent_count INTEGER DEFAULT 0")
+        
+        cursor.execute("""
+            UPDATE user_scores SET recent_count = (
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM user_grades g
+                    WHERE g.user_id = user_scores.user_id
+                    LIMIT 10
+                )
+            )
+        """)
+        cursor.execute("DROP TRIGGER IF EXISTS trg_user_scores_recent_mask")
+        cursor.execute("PRAGMA user_version = 5")
+    
     # Méthodes pour user_scores
     def get_user_score(self, user_id: int) -> Optional[Dict]:
         """Récupère les scores d'un utilisateur."""
+        cache_key = f"user_score:{user_id}"
+        cached = global_cache.get(cache_key)
+        if cached is not None:
+            # Copie : les appelants modifient parfois le dictionnaire retourné
+            return dict(cached)
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Score relu puis mis en cache : il doit inclure les écritures en file
+            self.flush()
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT user_id, name, correct, total, stars 
-                    FROM user_scores WHERE user_id = ?
-                """, (user_id,))
+                cursor.execute(_SQL_GET_USER_SCORE, (user_id,))
                 result = cursor.fetchone()
                 
                 if result:
-                    return {
-                        'correct': result[2],
-                        'total': result[3],
-                        'name': result[1],
-                        'stars': result[4]
-                    }
+                    # Les colonnes sélectionnées sont exactement les clés attendues
+                    score = dict(result)
+                    global_cache.set(cache_key, score, ttl=_SCORE_CACHE_TTL)
+                    return dict(score)
                 return None
         except Exception as e:
             logger.error(f"Erreur récupération score utilisateur {user_id}: {e}")
@@ -137,44 +495,65 @@ class DatabaseManager:
     def update_user_score(self, user_id: int, name: str, correct: int, total: int, stars: int):
         """Met à jour ou insère les scores d'un utilisateur."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT OR REPLACE INTO user_scores (user_id, name, correct, total, stars, updated_at)
-                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                """, (user_id, name, correct, total, stars))
-                conn.commit()
+            # Cache tenu à jour plutôt qu'invalidé : la lecture suivante ne touche pas la base.
+            # Mis à jour avant la mise en file : si l'écriture échoue, sa suppression passe après
+            global_cache.set(f"user_score:{user_id}",
+                             {'correct': correct, 'total': total, 'name': name, 'stars': stars},
+                             ttl=_SCORE_CACHE_TTL)
+            global_cache.delete(_ALL_SCORES_CACHE_KEY)
+            
+            self._defer_write(_SQL_UPSERT_USER_SCORE, (user_id, name, correct, total, stars),
+                              cache_keys=(f"user_score:{user_id}",))
         except Exception as e:
             logger.error(f"Erreur mise à jour score utilisateur {user_id}: {e}")
     
     def get_all_user_scores(self) -> Dict[int, Dict]:
         """Récupère tous les scores des utilisateurs."""
+        # Le cache garde des tuples immuables ; chaque appelant reçoit ses propres
+        # dictionnaires, qu'il peut modifier sans altérer le cache
+        rows = global_cache.get(_ALL_SCORES_CACHE_KEY)
+        if rows is None:
+            try:
+                self.flush()
+                with self.read_conn() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT user_id, name, correct, total, stars FROM user_scores")
+                    rows = [tuple(row) for row in cursor]
+                global_cache.set(_ALL_SCORES_CACHE_KEY, rows, ttl=_SCORE_CACHE_TTL)
+            except Exception as e:
+                logger.error(f"Erreur récupération tous les scores: {e}")
+                return {}
+        
+        return {
+            user_id: {'correct': correct, 'total': total, 'name': name, 'stars': stars}
+            for user_id, name, correct, total, stars in rows
+        }
+    
+    def record_user_answer(self, user_id: int, name: str, correct: int, total: int, stars: int,
+                           question: str, is_correct: bool, stars_earned: int):
+        """Enregistre une réponse : nouveau score et note, mis en file comme un seul groupe."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT user_id, name, correct, total, stars FROM user_scores")
-                results = cursor.fetchall()
-                
-                scores = {}
-                for result in results:
-                    scores[result[0]] = {
-                        'correct': result[2],
-                        'total': result[3],
-                        'name': result[1],
-                        'stars': result[4]
-                    }
-                return scores
+            global_cache.set(f"user_score:{user_id}",
+                             {'correct': correct, 'total': total, 'name': name, 'stars': stars},
+                             ttl=_SCORE_CACHE_TTL)
+            global_cache.delete(_ALL_SCORES_CACHE_KEY)
+            
+            self._defer_writes((
+                (_SQL_UPSERT_USER_SCORE, (user_id, name, correct, total, stars)),
+                (_SQL_INSERT_USER_GRADE, (user_id, question, is_correct, stars_earned)),
+            ), cache_keys=(f"user_score:{user_id}",))
         except Exception as e:
-            logger.error(f"Erreur récupération tous les scores: {e}")
-            return {}
+            logger.error(f"Erreur enregistrement réponse utilisateur {user_id}: {e}")
     
     # Méthodes pour user_warnings
     def get_user_warnings(self, user_id: int) -> int:
         """Récupère le nombre d'avertissements d'un utilisateur."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Lecture suivie d'une réécriture (add_user_warning) : voir la dernière valeur
+            self.flush()
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT warning_count FROM user_warnings WHERE user_id = ?", (user_id,))
+                cursor.execute(_SQL_GET_USER_WARNINGS, (user_id,))
                 result = cursor.fetchone()
                 return result[0] if result else 0
         except Exception as e:
@@ -184,30 +563,21 @@ class DatabaseManager:
     def update_user_warnings(self, user_id: int, warning_count: int):
         """Met à jour le nombre d'avertissements d'un utilisateur."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT OR REPLACE INTO user_warnings (user_id, warning_count, updated_at)
-                    VALUES (?, ?, CURRENT_TIMESTAMP)
-                """, (user_id, warning_count))
-                conn.commit()
+            self._defer_write(_SQL_UPSERT_USER_WARNINGS, (user_id, warning_count))
         except Exception as e:
             logger.error(f"Erreur mise à jour avertissements utilisateur {user_id}: {e}")
     
     def delete_user_warnings(self, user_id: int):
         """Supprime les avertissements d'un utilisateur."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM user_warnings WHERE user_id = ?", (user_id,))
-                conn.commit()
+            self._defer_write("DELETE FROM user_warnings WHERE user_id = ?", (user_id,))
         except Exception as e:
             logger.error(f"Erreur suppression avertissements utilisateur {user_id}: {e}")
     
     def get_all_warnings(self) -> Dict[int, int]:
         """Récupère tous les avertissements."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT user_id, warning_count FROM user_warnings")
                 results = cursor.fetchall()
@@ -220,43 +590,47 @@ class DatabaseManager:
     def add_user_grade(self, user_id: int, question: str, is_correct: bool, stars_earned: int):
         """Ajoute une note pour un utilisateur."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO user_grades (user_id, question, is_correct, stars_earned)
-                    VALUES (?, ?, ?, ?)
-                """, (user_id, question, is_correct, stars_earned))
-                conn.commit()
+            self._defer_write(_SQL_INSERT_USER_GRADE, (user_id, question, is_correct, stars_earned))
         except Exception as e:
             logger.error(f"Erreur ajout note utilisateur {user_id}: {e}")
     
+    def add_user_grades_bulk(self, rows: List[Tuple[int, str, bool, int]]):
+        """Ajoute plusieurs notes (user_id, question, is_correct, stars_earned) en une transaction."""
+        if not rows:
+            return
+        try:
+            with self.write_conn() as conn:
+                conn.executemany(_SQL_INSERT_USER_GRADE, rows)
+        except Exception as e:
+            logger.error(f"Erreur ajout groupé de {len(rows)} notes : {e}")
+    
     def get_user_grades(self, user_id: int) -> Dict:
         """Récupère les notes détaillées d'un utilisateur."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
+                
+                # Total des étoiles agrégé par SQLite (index idx_user_grades_user_id)
                 cursor.execute("""
-                    SELECT question, is_correct, stars_earned, answered_at
+                    SELECT COALESCE(SUM(stars_earned), 0) FROM user_grades WHERE user_id = ?
+                """, (user_id,))
+                total_stars = cursor.fetchone()[0]
+                
+                cursor.execute("""
+                    SELECT question, is_correct, stars_earned
                     FROM user_grades WHERE user_id = ?
                     ORDER BY answered_at DESC
                 """, (user_id,))
-                results = cursor.fetchall()
                 
                 correct = []
                 incorrect = []
-                total_stars = 0
                 
-                for result in results:
-                    question_data = {
-                        'question': result[0],
-                        'stars': result[2]
-                    }
-                    total_stars += result[2]
-                    
-                    if result[1]:  # is_correct
-                        correct.append(question_data)
-                    else:
-                        incorrect.append(question_data)
+                # Répartition en un seul passage sur le curseur, sans fetchall()
+                for question, is_correct, stars in cursor:
+                    (correct if is_correct else incorrect).append({
+                        'question': question,
+                        'stars': stars
+                    })
                 
                 return {
                     'correct': correct,
@@ -273,38 +647,24 @@ class DatabaseManager:
                        question_number: int = None):
         """Ajoute un poll actif."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT OR REPLACE INTO active_polls 
-                    (poll_id, question_data, chat_id, message_id, question, session_id, question_number)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (poll_id, json.dumps(question_data), chat_id, message_id, 
-                     question, session_id, question_number))
-                conn.commit()
+            self._defer_write(_SQL_UPSERT_ACTIVE_POLL, (poll_id, _encode_question(question_data), chat_id,
+                                                        message_id, question, session_id, question_number))
         except Exception as e:
             logger.error(f"Erreur ajout poll actif {poll_id}: {e}")
     
     def get_active_poll(self, poll_id: str) -> Optional[Dict]:
         """Récupère un poll actif."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            self.flush()
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT question_data, chat_id, message_id, question, session_id, question_number
-                    FROM active_polls WHERE poll_id = ?
-                """, (poll_id,))
+                cursor.execute(_SQL_GET_ACTIVE_POLL, (poll_id,))
                 result = cursor.fetchone()
                 
                 if result:
-                    return {
-                        'question_data': json.loads(result[0]),
-                        'chat_id': result[1],
-                        'message_id': result[2],
-                        'question': result[3],
-                        'session_id': result[4],
-                        'question_number': result[5]
-                    }
+                    poll = dict(result)
+                    poll['question_data'] = _decode_question(poll['question_data'])
+                    return poll
                 return None
         except Exception as e:
             logger.error(f"Erreur récupération poll actif {poll_id}: {e}")
@@ -313,10 +673,7 @@ class DatabaseManager:
     def remove_active_poll(self, poll_id: str):
         """Supprime un poll actif."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM active_polls WHERE poll_id = ?", (poll_id,))
-                conn.commit()
+            self._defer_write("DELETE FROM active_polls WHERE poll_id = ?", (poll_id,))
         except Exception as e:
             logger.error(f"Erreur suppression poll actif {poll_id}: {e}")
     
@@ -325,35 +682,35 @@ class DatabaseManager:
                               total_questions: int, participants: set):
         """Ajoute une session de quiz quotidien."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT OR REPLACE INTO daily_quiz_sessions 
-                    (session_id, chat_id, current_question, total_questions, participants)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (session_id, chat_id, current_question, total_questions, json.dumps(list(participants))))
-                conn.commit()
+                    (session_id, chat_id, current_question, total_questions, created_at)
+                    VALUES (?, ?, ?, ?, unixepoch())
+                """, (session_id, chat_id, current_question, total_questions))
+                self._replace_participants(cursor, session_id, participants)
         except Exception as e:
             logger.error(f"Erreur ajout session quiz quotidien {session_id}: {e}")
     
     def get_daily_quiz_session(self, session_id: str) -> Optional[Dict]:
         """Récupère une session de quiz quotidien."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Participants ajoutés par add_participant (écritures différées)
+            self.flush()
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT chat_id, current_question, total_questions, participants
+                    SELECT chat_id, current_question, total_questions
                     FROM daily_quiz_sessions WHERE session_id = ?
                 """, (session_id,))
                 result = cursor.fetchone()
                 
                 if result:
-                    return {
-                        'chat_id': result[0],
-                        'current_question': result[1],
-                        'total_questions': result[2],
-                        'participants': set(json.loads(result[3]))
-                    }
+                    session = dict(result)
+                    cursor.execute(_SQL_GET_PARTICIPANTS, (session_id,))
+                    session['participants'] = {row['user_id'] for row in cursor}
+                    return session
                 return None
         except Exception as e:
             logger.error(f"Erreur récupération session quiz quotidien {session_id}: {e}")
@@ -362,46 +719,72 @@ class DatabaseManager:
     def update_daily_quiz_session_participants(self, session_id: str, participants: set):
         """Met à jour les participants d'une session de quiz quotidien."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE daily_quiz_sessions SET participants = ?
-                    WHERE session_id = ?
-                """, (json.dumps(list(participants)), session_id))
-                conn.commit()
+                self._replace_participants(cursor, session_id, participants)
         except Exception as e:
             logger.error(f"Erreur mise à jour participants session {session_id}: {e}")
     
+    @staticmethod
+    def _replace_participants(cursor, session_id: str, participants: set):
+        """Remplace l'ensemble des participants d'une session (transaction déjà ouverte)."""
+        cursor.execute("DELETE FROM daily_quiz_participants WHERE session_id = ?", (session_id,))
+        cursor.executemany(
+            "INSERT OR IGNORE INTO daily_quiz_participants (session_id, user_id) VALUES (?, ?)",
+            [(session_id, user_id) for user_id in participants]
+        )
+    
+    def add_participant(self, session_id: str, user_id: int):
+        """Ajoute un participant à une session existante (une seule ligne écrite)."""
+        try:
+            self._defer_write(_SQL_ADD_PARTICIPANT, (session_id, user_id, session_id))
+        except Exception as e:
+            logger.error(f"Erreur ajout participant {user_id} session {session_id}: {e}")
+    
+    def get_participants(self, session_id: str) -> set:
+        """Récupère les participants d'une session de quiz quotidien."""
+        try:
+            self.flush()
+            with self.read_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_GET_PARTICIPANTS, (session_id,))
+                return {row[0] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"Erreur récupération participants session {session_id}: {e}")
+            return set()
+    
     def remove_daily_quiz_session(self, session_id: str):
         """Supprime une session de quiz quotidien."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM daily_quiz_sessions WHERE session_id = ?", (session_id,))
-                conn.commit()
+                cursor.execute("DELETE FROM daily_quiz_participants WHERE session_id = ?", (session_id,))
         except Exception as e:
             logger.error(f"Erreur suppression session quiz quotidien {session_id}: {e}")
     
     def cleanup_old_data(self, days: int = 30):
         """Nettoie les anciennes données (polls actifs et sessions expirées)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 
                 # Supprimer les polls actifs de plus de X jours
                 cursor.execute("""
                     DELETE FROM active_polls 
-                    WHERE created_at < datetime('now', '-{} days')
-                """.format(days))
+                    WHERE created_at < unixepoch('now', ?)
+                """, (f'-{int(days)} days',))
                 
                 # Supprimer les sessions de quiz de plus de X jours
                 cursor.execute("""
                     DELETE FROM daily_quiz_sessions 
-                    WHERE created_at < datetime('now', '-{} days')
-                """.format(days))
-                
-                conn.commit()
-                logger.info(f"Nettoyage des données anciennes de plus de {days} jours effectué")
+                    WHERE created_at < unixepoch('now', ?)
+                """, (f'-{int(days)} days',))
+                cursor.execute(_SQL_DELETE_ORPHAN_PARTICIPANTS)
+            
+            # Rendre au système les pages libérées (auto_vacuum=INCREMENTAL)
+            self._incremental_vacuum()
+            logger.info(f"Nettoyage des données anciennes de plus de {days} jours effectué")
                 
         except Exception as e:
             logger.error(f"Erreur nettoyage données anciennes : {e}")
@@ -409,15 +792,42 @@ class DatabaseManager:
     def _create_indexes(self, cursor):
         """Crée les index pour optimiser les performances."""
         try:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+            existing_indexes = {row[0] for row in cursor.fetchall()}
+            
             # Index sur user_scores pour le classement
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_scores_stars ON user_scores(stars DESC)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_scores_correct ON user_scores(correct DESC)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_scores_total ON user_scores(total)")
+            # total change à chaque réponse : cet index coûtait une mise à jour de plus par
+            # réponse, le filtre total > 0 est servi par l'index partiel ci-dessous
+            cursor.execute("DROP INDEX IF EXISTS idx_user_scores_total")
+            
+            # Index couvrants du classement paginé : tri (user_id départage les ex æquo,
+            # clé de la pagination par curseur) et colonnes lus dans l'index seul ;
+            # variante partielle pour group_only
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_scores_rank_cov
+                ON user_scores(stars DESC, correct DESC, user_id, name, total)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_scores_rank_active
+                ON user_scores(stars DESC, correct DESC, user_id, name, total) WHERE total > 0
+            """)
             
             # Index sur user_grades pour les requêtes par utilisateur
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_grades_user_id ON user_grades(user_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_grades_answered_at ON user_grades(answered_at DESC)")
             
+            # Index couvrant des classements par période, sur l'horodatage entier
+            # (parcours limité à l'index, stars_earned inclus pour les SUM)
+            cursor.execute("DROP INDEX IF EXISTS idx_ug_answered_user_correct")
+            cursor.execute("DROP INDEX IF EXISTS idx_ug_time_user_cov")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ug_ts_user_cov
+                ON user_grades(answered_at_ts, user_id, is_correct, stars_earned)
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_ug_question_correct ON user_grades(question, is_correct)")
+            
             # Index sur active_polls pour les requêtes rapides
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_active_polls_chat_id ON active_polls(chat_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_active_polls_session_id ON active_polls(session_id)")
@@ -426,55 +836,305 @@ class DatabaseManager:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_badges_user_id ON user_badges(user_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_badges_earned_at ON user_badges(earned_at DESC)")
             
+            # Collecter les statistiques une première fois pour que l'optimiseur choisisse les index
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                cursor.execute("ANALYZE")
+            else:
+                # Base existante : analyser chaque table qui a reçu un nouvel index
+                cursor.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'")
+                new_index_tables = {row[1] for row in cursor.fetchall() if row[0] not in existing_indexes}
+                for table in sorted(new_index_tables):
+                    cursor.execute(f'ANALYZE "{table}"')
+            
             logger.info("Index créés avec succès")
         except Exception as e:
             logger.error(f"Erreur création index : {e}")
     
-    def get_ranking_paginated(self, page: int = 1, per_page: int = 20, group_only: bool = False) -> Dict:
-        """Récupère le classement avec pagination."""
+    def _create_rollups(self, cursor):
+        """Crée les agrégats (journaliers et par question) de user_grades, maintenus par trigger."""
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_grades_daily (
+                    day TEXT PRIMARY KEY,
+                    questions INTEGER DEFAULT 0,
+                    correct INTEGER DEFAULT 0
+                )
+            """)
+            
+            # Utilisateurs distincts par jour (compter les lignes donne les actifs)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_grades_daily_users (
+                    day TEXT,
+                    user_id INTEGER,
+                    PRIMARY KEY (day, user_id)
+                ) WITHOUT ROWID
+            """)
+            
+            # Initialiser les agrégats à partir des notes existantes ; la version 4 les
+            # reconstruit une fois (les notes archivées avant le trigger de suppression
+            # y étaient restées comptées)
+            cursor.execute("PRAGMA user_version")
+            rebuild = cursor.fetchone()[0] < 4
+            cursor.execute("SELECT 1 FROM user_grades_daily LIMIT 1")
+            if cursor.fetchone() is None or rebuild:
+                cursor.execute("DELETE FROM user_grades_daily")
+                cursor.execute("DELETE FROM user_grades_daily_users")
+                cursor.execute("""
+                    INSERT INTO user_grades_daily (day, questions, correct)
+                    SELECT DATE(answered_at), COUNT(*), COUNT(*) FILTER (WHERE is_correct)
+                    FROM user_grades
+                    GROUP BY DATE(answered_at)
+                """)
+                cursor.execute("""
+                    INSERT OR IGNORE INTO user_grades_daily_users (day, user_id)
+                    SELECT DISTINCT DATE(answered_at), user_id FROM user_grades
+                """)
+            
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_user_grades_daily
+                AFTER INSERT ON user_grades
+                BEGIN
+                    INSERT INTO user_grades_daily (day, questions, correct)
+                    VALUES (DATE(NEW.answered_at), 1, CASE WHEN NEW.is_correct THEN 1 ELSE 0 END)
+                    ON CONFLICT(day) DO UPDATE SET
+                        questions = questions + 1,
+                        correct = correct + excluded.correct;
+                    INSERT OR IGNORE INTO user_grades_daily_users (day, user_id)
+                    VALUES (DATE(NEW.answered_at), NEW.user_id);
+                END
+            """)
+            
+            # Les notes archivées ou purgées ne comptent plus dans l'activité journalière
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_user_grades_daily_delete
+                AFTER DELETE ON user_grades
+                BEGIN
+                    UPDATE user_grades_daily SET
+                        questions = questions - 1,
+                        correct = correct - (CASE WHEN OLD.is_correct THEN 1 ELSE 0 END)
+                    WHERE day = DATE(OLD.answered_at);
+                    DELETE FROM user_grades_daily
+                    WHERE day = DATE(OLD.answered_at) AND questions <= 0;
+                    DELETE FROM user_grades_daily_users
+                    WHERE day = DATE(OLD.answered_at) AND user_id = OLD.user_id
+                      AND NOT EXISTS (
+                          SELECT 1 FROM user_grades
+                          WHERE user_id = OLD.user_id
+                            AND answered_at_ts >= unixepoch(DATE(OLD.answered_at))
+                            AND answered_at_ts < unixepoch(DATE(OLD.answered_at), '+1 day')
+                      );
+                END
+            """)
+            if rebuild:
+                cursor.execute("PRAGMA user_version = 4")
+            
+            # Décaler la fenêtre des 10 dernières réponses de l'utilisateur ; recent_count
+            # compte les bits réellement remplis (plafonné à 10)
+            self._migrate_recent_count(cursor)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_user_scores_recent_mask
+                AFTER INSERT ON user_grades
+                BEGIN
+                    UPDATE user_scores
+                    SET recent_mask = ((recent_mask << 1) | (CASE WHEN NEW.is_correct THEN 1 ELSE 0 END)) & 1023,
+                        recent_count = MIN(recent_count + 1, 10)
+                    WHERE user_id = NEW.user_id;
+                END
+            """)
+            
+            # Statistiques par question (classification de difficulté par lecture ponctuelle)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS question_stats (
+                    question TEXT PRIMARY KEY,
+                    total INTEGER DEFAULT 0,
+                    correct INTEGER DEFAULT 0
+                )
+            """)
+            
+            cursor.execute("SELECT 1 FROM question_stats LIMIT 1")
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    INSERT INTO question_stats (question, total, correct)
+                    SELECT question, COUNT(*), COUNT(*) FILTER (WHERE is_correct)
+                    FROM user_grades
+                    GROUP BY question
+                """)
+            
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_question_stats_insert
+                AFTER INSERT ON user_grades
+                BEGIN
+                    INSERT INTO question_stats (question, total, correct)
+                    VALUES (NEW.question, 1, CASE WHEN NEW.is_correct THEN 1 ELSE 0 END)
+                    ON CONFLICT(question) DO UPDATE SET
+                        total = total + 1,
+                        correct = correct + excluded.correct;
+                END
+            """)
+            
+            # Les notes purgées par le nettoyage ne comptent plus dans les statistiques
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_question_stats_delete
+                AFTER DELETE ON user_grades
+                BEGIN
+                    UPDATE question_stats SET
+                        total = total - 1,
+                        correct = correct - (CASE WHEN OLD.is_correct THEN 1 ELSE 0 END)
+                    WHERE question = OLD.question;
+                END
+            """)
+        except Exception as e:
+            logger.error(f"Erreur création agrégats : {e}")
+    
+    def _create_question_search(self, cursor):
+        """Crée (ou retire) l'index FTS5 des questions, synchronisé par trigger."""
+        try:
+            if not ENABLE_QUESTION_SEARCH:
+                # Désactivé : ne rien laisser qui alourdisse les insertions
+                for trigger in ('user_grades_fts_ai', 'user_grades_fts_ad', 'user_grades_fts_au'):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                cursor.execute("DROP TABLE IF EXISTS user_grades_fts")
+                return
+            
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'user_grades_fts'")
+            exists = cursor.fetchone() is not None
+            
+            # Table à contenu externe : le texte reste dans user_grades, seul l'index est stocké
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS user_grades_fts
+                USING fts5(question, content='user_grades', content_rowid='id')
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS user_grades_fts_ai AFTER INSERT ON user_grades BEGIN
+                    INSERT INTO user_grades_fts (rowid, question) VALUES (NEW.id, NEW.question);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS user_grades_fts_ad AFTER DELETE ON user_grades BEGIN
+                    INSERT INTO user_grades_fts (user_grades_fts, rowid, question)
+                    VALUES ('delete', OLD.id, OLD.question);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS user_grades_fts_au AFTER UPDATE OF question ON user_grades BEGIN
+                    INSERT INTO user_grades_fts (user_grades_fts, rowid, question)
+                    VALUES ('delete', OLD.id, OLD.question);
+                    INSERT INTO user_grades_fts (rowid, question) VALUES (NEW.id, NEW.question);
+                END
+            """)
+            
+            if not exists:
+                # Indexer les notes déjà présentes
+                cursor.execute("INSERT INTO user_grades_fts (user_grades_fts) VALUES ('rebuild')")
+        except Exception as e:
+            logger.error(f"Erreur création index plein texte : {e}")
+    
+    def search_grades(self, query: str, user_id: Optional[int] = None, limit: int = 20) -> List[Dict]:
+        """Recherche des notes par texte de question (FTS5 si activé, sinon LIKE)."""
         try:
-            offset = (page - 1) * per_page
+            user_filter = "AND g.user_id = ?" if user_id is not None else ""
+            
+            if ENABLE_QUESTION_SEARCH:
+                # Chaque mot entre guillemets : le texte saisi n'est pas interprété comme syntaxe FTS5
+                terms = ' '.join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+                if not terms:
+                    return []
+                sql = f"""
+                    SELECT g.question, g.is_correct, g.stars_earned, g.answered_at
+                    FROM user_grades_fts f JOIN user_grades g ON g.id = f.rowid
+                    WHERE user_grades_fts MATCH ? {user_filter}
+                    ORDER BY f.rank
+                    LIMIT ?
+                """
+                params = [terms]
+            else:
+                sql = f"""
+                    SELECT g.question, g.is_correct, g.stars_earned, g.answered_at
+                    FROM user_grades g
+                    WHERE g.question LIKE ? ESCAPE '\\' {user_filter}
+                    ORDER BY g.answered_at DESC
+                    LIMIT ?
+                """
+                # %, _ et \ saisis sont cherchés tels quels, pas comme jokers LIKE
+                escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params = [f"%{escaped}%"]
+            
+            if user_id is not None:
+                params.append(user_id)
+            params.append(limit)
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self.read_conn() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                return [
+                    {'question': question, 'is_correct': bool(is_correct),
+                     'stars': stars, 'answered_at': answered_at}
+                    for question, is_correct, stars, answered_at in cursor
+                ]
+        except Exception as e:
+            logger.error(f"Erreur recherche dans les notes : {e}")
+            return []
+    
+    def get_ranking_paginated(self, page: int = 1, per_page: int = 20, group_only: bool = False,
+                              after: Optional[Tuple[int, int, int]] = None) -> Dict:
+        """Récupère le classement avec pagination.
+        
+        after : curseur (stars, correct, user_id) de la dernière ligne de la page
+        précédente (pagination['next_cursor']) ; reprend juste après lui dans l'index
+        au lieu de parcourir et d'écarter les lignes des pages précédentes (OFFSET).
+        """
+        try:
+            where = "WHERE total > 0" if group_only else ""
+            
+            if after is not None:
+                seek = "stars <= ? AND (stars < ? OR correct < ? OR (correct = ? AND user_id > ?))"
+                page_where = f"{where} AND {seek}" if where else f"WHERE {seek}"
+                stars, correct, last_user_id = after
+                params = (stars, stars, correct, correct, last_user_id, per_page, 0)
+            else:
+                page_where = where
+                params = (per_page, (page - 1) * per_page)
+            
+            self.flush()
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 
-                # Requête pour compter le total
-                if group_only:
-                    cursor.execute("SELECT COUNT(*) FROM user_scores WHERE total > 0")
-                else:
-                    cursor.execute("SELECT COUNT(*) FROM user_scores")
-                total_count = cursor.fetchone()[0]
-                
-                # Requête paginée optimisée avec index
-                if group_only:
-                    cursor.execute("""
-                        SELECT user_id, name, correct, total, stars 
-                        FROM user_scores 
-                        WHERE total > 0
-                        ORDER BY stars DESC, correct DESC 
-                        LIMIT ? OFFSET ?
-                    """, (per_page, offset))
-                else:
-                    cursor.execute("""
-                        SELECT user_id, name, correct, total, stars 
-                        FROM user_scores 
-                        ORDER BY stars DESC, correct DESC 
-                        LIMIT ? OFFSET ?
-                    """, (per_page, offset))
+                # Page et nombre total de lignes en une seule requête ; sous-requête scalaire
+                # (évaluée une fois) plutôt que COUNT(*) OVER (), qui imposerait un tri
+                # temporaire au lieu du parcours de l'index couvrant
+                cursor.execute(f"""
+                    SELECT user_id, name, correct, total, stars,
+                           (SELECT COUNT(*) FROM user_scores {where}) as total_count
+                    FROM user_scores 
+                    {page_where}
+                    ORDER BY stars DESC, correct DESC, user_id
+                    LIMIT ? OFFSET ?
+                """, params)
                 
                 results = cursor.fetchall()
                 
-                ranking_data = []
-                for result in results:
-                    ranking_data.append((result[0], {
-                        'correct': result[2],
-                        'total': result[3],
-                        'name': result[1],
-                        'stars': result[4]
-                    }))
+                if results:
+                    total_count = results[0]['total_count']
+                else:
+                    # Page au-delà de la fin : aucune ligne pour porter le total
+                    cursor.execute(f"SELECT COUNT(*) FROM user_scores {where}")
+                    total_count = cursor.fetchone()[0]
+                
+                ranking_data = [
+                    (row['user_id'], {'correct': row['correct'], 'total': row['total'],
+                                      'name': row['name'], 'stars': row['stars']})
+                    for row in results
+                ]
                 
                 total_pages = (total_count + per_page - 1) // per_page
                 
+                # Curseur de la page suivante : clé de tri de la dernière ligne
+                next_cursor = None
+                if len(results) == per_page:
+                    last = results[-1]
+                    next_cursor = (last['stars'], last['correct'], last['user_id'])
+                
                 return {
                     'ranking': ranking_data,
                     'pagination': {
@@ -483,7 +1143,8 @@ class DatabaseManager:
                         'total_pages': total_pages,
                         'total_count': total_count,
                         'has_next': page < total_pages,
-                        'has_prev': page > 1
+                        'has_prev': page > 1,
+                        'next_cursor': next_cursor
                     }
                 }
                 
@@ -494,7 +1155,7 @@ class DatabaseManager:
     def archive_old_data(self, days: int = 90):
         """Archive les anciennes données avant suppression."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.write_conn() as conn:
                 cursor = conn.cursor()
                 
                 # Archiver les anciennes notes (user_grades)
@@ -510,55 +1171,90 @@ class DatabaseManager:
                         )
                     )
                     FROM user_grades 
-                    WHERE answered_at < datetime('now', '-{} days')
-                """.format(days))
+                    WHERE answered_at < datetime('now', ?)
+                """, (f'-{int(days)} days',))
                 
                 # Supprimer après archivage
                 cursor.execute("""
                     DELETE FROM user_grades 
-                    WHERE answered_at < datetime('now', '-{} days')
-                """.format(days))
+                    WHERE answered_at < datetime('now', ?)
+                """, (f'-{int(days)} days',))
                 
                 archived_count = cursor.rowcount
                 
                 # Nettoyer les polls et sessions expirés
                 cursor.execute("""
                     DELETE FROM active_polls 
-                    WHERE created_at < datetime('now', '-7 days')
+                    WHERE created_at < unixepoch('now', '-7 days')
                 """)
                 
                 cursor.execute("""
                     DELETE FROM daily_quiz_sessions 
-                    WHERE created_at < datetime('now', '-7 days')
+                    WHERE created_at < unixepoch('now', '-7 days')
                 """)
+                cursor.execute(_SQL_DELETE_ORPHAN_PARTICIPANTS)
                 
-                conn.commit()
                 logger.info(f"Archivage terminé : {archived_count} entrées archivées")
                 
         except Exception as e:
             logger.error(f"Erreur archivage données : {e}")
     
-    def optimize_database(self):
-        """Optimise la base de données (VACUUM, ANALYZE)."""
+    def _incremental_vacuum(self, max_pages: Optional[int] = None):
+        """Libère des pages vides du fichier (max_pages=None : toutes).
+        
+        sqlite3 n'exécute qu'un pas d'un PRAGMA sans colonne par execute(), soit
+        une seule page ; executescript() le mène à terme en un appel. Comme il
+        valide d'abord la transaction en cours, il s'exécute hors de tout bloc
+        d'écriture englobant.
+        """
+        if max_pages is not None and max_pages <= 0:
+            return
+        if self.pool._owns_writer():
+            # Ne pas valider prématurément la transaction de l'appelant : les pages
+            # seront rendues au prochain nettoyage
+            return
+        with self.write_conn() as conn:
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages or 0)});")
+    
+    def optimize_database(self, full: bool = False, vacuum_pages: int = 1000):
+        """Optimise la base de données.
+        
+        Par défaut, libère au plus vacuum_pages pages vides (auto_vacuum=INCREMENTAL)
+        et laisse PRAGMA optimize rafraîchir les statistiques utiles. full=True
+        reconstruit tout le fichier (VACUUM, ANALYZE) : coûteux, à réserver aux
+        opérations de maintenance exceptionnelles.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Analyser les statistiques pour l'optimiseur
-                cursor.execute("ANALYZE")
-                
-                # Compacter la base de données
-                cursor.execute("VACUUM")
+            if full:
+                # VACUUM ne peut s'exécuter dans une transaction : connexion dédiée en autocommit
+                with closing(self._connect(isolation_level=None)) as conn:
+                    cursor = conn.cursor()
+                    
+                    # Analyser les statistiques pour l'optimiseur
+                    cursor.execute("ANALYZE")
+                    
+                    # Compacter la base de données
+                    cursor.execute("VACUUM")
+            else:
+                self._incremental_vacuum(vacuum_pages)
                 
-                logger.info("Optimisation de la base de données terminée")
+                with self.write_conn() as conn:
+                    # N'analyse que les tables dont les statistiques sont périmées
+                    conn.execute("PRAGMA optimize")
+            
+            logger.info("Optimisation de la base de données terminée")
                 
         except Exception as e:
             logger.error(f"Erreur optimisation base de données : {e}")
     
-    def get_database_stats(self) -> Dict:
-        """Récupère les statistiques de la base de données."""
+    def get_database_stats(self, exact: bool = False) -> Dict:
+        """Récupère les statistiques de la base de données.
+        
+        Les nombres de lignes sont par défaut des estimations lues dans sqlite_stat1
+        (rafraîchie par ANALYZE / PRAGMA optimize) ; exact=True les compte réellement.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.read_conn() as conn:
                 cursor = conn.cursor()
                 
                 stats = {}
@@ -567,9 +1263,22 @@ class DatabaseManager:
                 tables = ['user_scores', 'user_grades', 'user_warnings', 'active_polls', 
                          'daily_quiz_sessions', 'user_badges', 'archived_data']
                 
+                # Premier nombre de chaque statistique : lignes de la table au dernier ANALYZE
+                estimates = {}
+                if not exact:
+                    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+                    if cursor.fetchone() is not None:
+                        cursor.execute("SELECT tbl, stat FROM sqlite_stat1")
+                        for table, stat in cursor.fetchall():
+                            estimates[table] = max(estimates.get(table, 0), int(stat.split()[0]))
+                
                 for table in tables:
-                    cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                    stats[f"{table}_count"] = cursor.fetchone()[0]
+                    if table in estimates:
+                        stats[f"{table}_count"] = estimates[table]
+                    else:
+                        # Table jamais analysée (ou vide lors de l'ANALYZE) : comptage exact
+                        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                        stats[f"{table}_count"] = cursor.fetchone()[0]
                 
                 # Taille du fichier
                 stats['db_size_bytes'] = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
@@ -581,6 +1290,152 @@ class DatabaseManager:
             logger.error(f"Erreur récupération stats DB : {e}")
             return {}
     
+    def _defer_write(self, sql: str, params: tuple, cache_keys: tuple = ()):
+        """Met une écriture en file ; elle sera validée avec les suivantes en un seul commit."""
+        self._defer_writes(((sql, params),), cache_keys)
+    
+    def _defer_writes(self, writes: tuple, cache_keys: tuple = ()):
+        """Met en file un groupe d'écritures, appliqué entièrement ou pas du tout.
+        
+        cache_keys : entrées du cache déjà mises à jour avec ces valeurs, supprimées
+        si l'écriture échoue pour ne pas annoncer un état absent de la base.
+        """
+        if self.pool._owns_writer():
+            # Dans une transaction ouverte : écrire tout de suite pour valider avec elle
+            with self.write_conn() as conn:
+                for sql, params in writes:
+                    conn.execute(sql, params)
+            return
+        
+        with self._pending_lock:
+            self._pending_writes.append((writes, cache_keys))
+            batch_full = len(self._pending_writes) >= _WRITE_BATCH_SIZE
+            if not batch_full:
+                self._schedule_flush()
+        
+        if batch_full:
+            self.flush()
+    
+    def _schedule_flush(self):
+        """Arme le minuteur d'écritures différées (verrou de la file déjà pris)."""
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(_WRITE_BATCH_DELAY, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def _timed_flush(self):
+        """Échéance du minuteur d'écritures différées."""
+        with self._pending_lock:
+            self._flush_timer = None
+        self.flush()
+    
+    def _take_pending(self) -> list:
+        """Retire et retourne les groupes d'écritures en file."""
+        with self._pending_lock:
+            batch, self._pending_writes = self._pending_writes, []
+        return batch
+    
+    def _apply_writes(self, conn: sqlite3.Connection, batch: list):
+        """Exécute des groupes d'écritures (connexion d'écriture détenue, transaction ouverte)."""
+        conn.execute("SAVEPOINT pending_writes")
+        try:
+            # Requêtes identiques consécutives regroupées, l'ordre d'arrivée est conservé
+            writes = [write for unit, _ in batch for write in unit]
+            for sql, group in groupby(writes, key=lambda write: write[0]):
+                conn.executemany(sql, [params for _, params in group])
+            conn.execute("RELEASE pending_writes")
+        except Exception as e:
+            conn.execute("ROLLBACK TO pending_writes")
+            conn.execute("RELEASE pending_writes")
+            logger.error(f"Erreur écritures groupées, reprise groupe par groupe : {e}")
+            # Un groupe invalide ne doit pas faire perdre les autres
+            for unit, cache_keys in batch:
+                conn.execute("SAVEPOINT pending_unit")
+                try:
+                    for sql, params in unit:
+                        conn.execute(sql, params)
+                    conn.execute("RELEASE pending_unit")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO pending_unit")
+                    conn.execute("RELEASE pending_unit")
+                    logger.error(f"Erreur écriture différée : {e}")
+                    self._invalidate_cache_keys(((unit, cache_keys),))
+    
+    @staticmethod
+    def _invalidate_cache_keys(batch: list):
+        """Supprime du cache les valeurs annoncées par des écritures non validées."""
+        for _, cache_keys in batch:
+            for key in cache_keys:
+                global_cache.delete(key)
+    
+    def flush(self):
+        """Valide immédiatement les écritures différées en attente.
+        
+        À appeler avant une lecture qui doit voir les écritures différées.
+        """
+        if not self._pending_writes:
+            return
+        batch = self._take_pending()
+        if not batch:
+            return
+        try:
+            with self.pool.writer() as conn:
+                self._apply_writes(conn, batch)
+        except Exception as e:
+            logger.error(f"Erreur validation des écritures différées : {e}")
+            self._invalidate_cache_keys(batch)
+    
+    @contextmanager
+    def _write_block(self):
+        """Connexion d'écriture, après les écritures différées pour en respecter l'ordre."""
+        if self.pool._owns_writer():
+            with self.pool.writer() as conn:
+                yield conn
+            return
+        
+        batch = self._take_pending()
+        try:
+            with self.pool.writer() as conn:
+                if batch:
+                    self._apply_writes(conn, batch)
+                yield conn
+        except Exception:
+            # L'échec du bloc annule aussi la file appliquée avec lui : la remettre en tête
+            if batch:
+                with self._pending_lock:
+                    self._pending_writes[:0] = batch
+                    self._schedule_flush()
+            raise
+    
     def connection(self):
-        """Retourne une connexion à la base de données."""
-        return sqlite3.connect(self.db_path)
+        """Prête la connexion persistante du thread courant (aucune ouverture de fichier).
+        
+        Connexion en lecture seule (PRAGMA query_only) : les écritures passent par
+        txn() ou write_conn().
+        """
+        return self.read_conn()
+    
+    @contextmanager
+    def txn(self):
+        """Transaction d'écriture (BEGIN IMMEDIATE, COMMIT ou ROLLBACK) fournissant un curseur."""
+        with self.write_conn() as conn:
+            yield conn.cursor()
+    
+    def read_conn(self):
+        """Emprunte une connexion de lecture au pool.
+        
+        Les écritures différées ne sont pas validées au passage : les lectures qui
+        doivent les voir appellent flush() d'abord.
+        """
+        return self.pool.reader()
+    
+    def write_conn(self):
+        """Emprunte la connexion d'écriture du pool (transaction validée à la sortie)."""
+        return self._write_block()
+    
+    def transaction(self):
+        """Regroupe plusieurs appels d'écriture en un seul commit.
+        
+        Exemple : with db.transaction(): db.update_user_warnings(...); db.remove_active_poll(...)
+        """
+        return self._write_block()
@@ -1,11 +1,30 @@
 
+import hashlib
 import logging
 from typing import Dict, List, Optional
 from database import DatabaseManager
+from cache_manager import global_cache
 from enum import Enum
 
 logger = logging.getLogger(__name__)
 
+# Requêtes partagées (mêmes chaînes à chaque appel : cache de requêtes préparées)
+_SQL_RECENT_MASK = "SELECT recent_mask, recent_count FROM user_scores WHERE user_id = ?"
+_SQL_QUESTION_STATS = "SELECT total, correct FROM question_stats WHERE question = ?"
+_SQL_DIFFICULTY_BUCKETS = """
+    SELECT CASE WHEN rate >= ? THEN ?
+                WHEN rate >= ? THEN ?
+                ELSE ? END as level,
+           COUNT(*) as question_count,
+           AVG(rate) as avg_success_rate
+    FROM (
+        SELECT 100.0 * correct / total as rate
+        FROM question_stats
+        WHERE total >= 3
+    )
+    GROUP BY level
+"""
+
 class DifficultyLevel(Enum):
     FACILE = "facile"
     MOYEN = "moyen"
@@ -19,27 +38,39 @@ class DifficultyManager:
             DifficultyLevel.MOYEN: {'min_success_rate': 40, 'max_success_rate': 69},
             DifficultyLevel.DIFFICILE: {'min_success_rate': 0, 'max_success_rate': 39}
         }
+        # Seuils minimaux par ordre décroissant : le premier atteint donne le niveau
+        self._buckets = sorted(
+            ((t['min_success_rate'], level) for level, t in self.difficulty_thresholds.items()),
+            key=lambda bucket: bucket[0], reverse=True
+        )
     
     def get_user_recommended_difficulty(self, user_id: int) -> DifficultyLevel:
         """Recommande un niveau de difficulté basé sur les performances de l'utilisateur."""
+        cache_key = f"diff_user_{user_id}"
+        cached = global_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        level = self._compute_user_recommended_difficulty(user_id)
+        global_cache.set(cache_key, level, ttl=60)  # invalidé à chaque réponse
+        return level
+    
+    def _compute_user_recommended_difficulty(self, user_id: int) -> DifficultyLevel:
+        """Calcule le niveau recommandé à partir de la fenêtre des dernières réponses."""
         try:
             with self.db.connection() as conn:
                 cursor = conn.cursor()
                 
-                # Calculer le taux de réussite des 10 dernières questions
-                cursor.execute("""
-                    SELECT is_correct FROM user_grades 
-                    WHERE user_id = ? 
-                    ORDER BY answered_at DESC 
-                    LIMIT 10
-                """, (user_id,))
-                
-                recent_answers = cursor.fetchall()
+                # Fenêtre des 10 dernières réponses tenue à jour par trigger :
+                # un bit par réponse, 1 = correcte ; recent_count = bits remplis
+                cursor.execute(_SQL_RECENT_MASK, (user_id,))
                 
-                if len(recent_answers) < 3:
+                result = cursor.fetchone()
+                if result is None or result[1] < 3:
                     return DifficultyLevel.FACILE
                 
-                success_rate = (sum(1 for answer in recent_answers if answer[0]) / len(recent_answers)) * 100
+                recent_mask, recent_total = result
+                success_rate = (recent_mask.bit_count() / recent_total) * 100
                 
                 if success_rate >= 80:
                     return DifficultyLevel.DIFFICILE
@@ -54,30 +85,37 @@ class DifficultyManager:
     
     def classify_question_difficulty(self, question: str) -> DifficultyLevel:
         """Classifie automatiquement la difficulté d'une question selon les statistiques."""
+        digest = hashlib.blake2b(question.encode('utf-8'), digest_size=8).hexdigest()
+        cache_key = f"diff_question_{digest}"
+        cached = global_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        level = self._compute_question_difficulty(question)
+        global_cache.set(cache_key, level, ttl=600)  # 10 minutes
+        return level
+    
+    def _compute_question_difficulty(self, question: str) -> DifficultyLevel:
+        """Classe une question d'après son agrégat question_stats."""
         try:
             with self.db.connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT COUNT(*) as total,
-                           SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct
-                    FROM user_grades 
-                    WHERE question = ?
-                """, (question,))
+                # Lecture ponctuelle de l'agrégat maintenu par trigger
+                cursor.execute(_SQL_QUESTION_STATS, (question,))
                 
                 result = cursor.fetchone()
-                total, correct = result[0], result[1] or 0
+                total, correct = (result[0], result[1] or 0) if result else (0, 0)
                 
                 if total < 5:  # Pas assez de données
                     return DifficultyLevel.MOYEN
                 
                 success_rate = (correct / total) * 100
                 
-                for level, thresholds in self.difficulty_thresholds.items():
-                    if thresholds['min_success_rate'] <= success_rate <= thresholds['max_success_rate']:
-                        return level
-                
-                return DifficultyLevel.MOYEN
+                return next(
+                    (level for threshold, level in self._buckets if success_rate >= threshold),
+                    DifficultyLevel.MOYEN
+                )
                 
         except Exception as e:
             logger.error(f"Erreur classification difficulté question: {e}")
@@ -91,36 +129,21 @@ class DifficultyManager:
             with self.db.connection() as conn:
                 cursor = conn.cursor()
                 
-                # Récupérer toutes les questions avec leurs stats
-                cursor.execute("""
-                    SELECT question,
-                           COUNT(*) as total_attempts,
-                           SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct_attempts
-                    FROM user_grades
-                    GROUP BY question
-                    HAVING COUNT(*) >= 3
-                """)
-                
-                questions_stats = cursor.fetchall()
+                # Répartition par niveau calculée en SQL sur l'agrégat question_stats :
+                # un seul GROUP BY sur le niveau, sans boucle Python par question
+                cursor.execute(_SQL_DIFFICULTY_BUCKETS, (
+                    self.difficulty_thresholds[DifficultyLevel.FACILE]['min_success_rate'],
+                    DifficultyLevel.FACILE.value,
+                    self.difficulty_thresholds[DifficultyLevel.MOYEN]['min_success_rate'],
+                    DifficultyLevel.MOYEN.value,
+                    DifficultyLevel.DIFFICILE.value
+                ))
                 
                 for level in DifficultyLevel:
                     stats[level.value] = {'count': 0, 'avg_success_rate': 0}
                 
-                level_questions = {level: [] for level in DifficultyLevel}
-                
-                for question, total, correct in questions_stats:
-                    success_rate = (correct / total) * 100 if total > 0 else 0
-                    
-                    for level, thresholds in self.difficulty_thresholds.items():
-                        if thresholds['min_success_rate'] <= success_rate <= thresholds['max_success_rate']:
-                            level_questions[level].append(success_rate)
-                            break
-                
-                for level, success_rates in level_questions.items():
-                    stats[level.value] = {
-                        'count': len(success_rates),
-                        'avg_success_rate': sum(success_rates) / len(success_rates) if success_rates else 0
-                    }
+                for level, count, avg_success_rate in cursor:
+                    stats[level] = {'count': count, 'avg_success_rate': avg_success_rate}
                 
                 return stats
                 
@@ -1,169 +1,239 @@
 
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import threading
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
 from database import DatabaseManager
 from cache_manager import global_cache
 
 logger = logging.getLogger(__name__)
 
+# Ligne de classement : tuple nommé plutôt qu'un dictionnaire par utilisateur
+LeaderboardEntry = namedtuple('LeaderboardEntry', 'user_id name questions correct stars percentage')
+
+# Classements des trois périodes en une requête, chaîne partagée pour le cache de requêtes
+# préparées. Un seul parcours des notes du mois, agrégées par période via des SUM
+# conditionnels, puis un ROW_NUMBER par période pour ne garder que le top ; aucune jointure,
+# les noms sont lus ensuite pour les seuls utilisateurs retenus. « GROUP BY +user_id » :
+# l'optimiseur parcourt la plage de l'index couvrant idx_ug_ts_user_cov au lieu de tout
+# idx_user_grades_user_id. Bornes en secondes Unix : comparaisons entières sur answered_at_ts.
+_SQL_ALL_LEADERBOARDS = """
+    WITH recent AS (
+        SELECT user_id,
+               COUNT(*) FILTER (WHERE answered_at_ts >= :day_start AND answered_at_ts < :day_end) as q_day,
+               COUNT(*) FILTER (WHERE answered_at_ts >= :day_start AND answered_at_ts < :day_end AND is_correct) as c_day,
+               SUM(CASE WHEN answered_at_ts >= :day_start AND answered_at_ts < :day_end THEN stars_earned ELSE 0 END) as s_day,
+               COUNT(*) FILTER (WHERE answered_at_ts >= :week) as q_week,
+               COUNT(*) FILTER (WHERE answered_at_ts >= :week AND is_correct) as c_week,
+               SUM(CASE WHEN answered_at_ts >= :week THEN stars_earned ELSE 0 END) as s_week,
+               COUNT(*) as q_month,
+               COUNT(*) FILTER (WHERE is_correct) as c_month,
+               SUM(stars_earned) as s_month
+        FROM user_grades
+        WHERE answered_at_ts >= :month
+        GROUP BY +user_id
+    ),
+    ranked AS (
+        SELECT recent.*,
+               100.0 * c_day / NULLIF(q_day, 0) as p_day,
+               100.0 * c_week / NULLIF(q_week, 0) as p_week,
+               100.0 * c_month / q_month as p_month,
+               ROW_NUMBER() OVER (ORDER BY q_day > 0 DESC, s_day DESC, c_day DESC) as rn_day,
+               ROW_NUMBER() OVER (ORDER BY q_week > 0 DESC, s_week DESC, c_week DESC) as rn_week,
+               ROW_NUMBER() OVER (ORDER BY s_month DESC, c_month DESC) as rn_month
+        FROM recent
+    )
+    SELECT * FROM ranked
+    WHERE (rn_day <= :limit AND q_day > 0)
+       OR (rn_week <= :limit AND q_week > 0)
+       OR rn_month <= :limit
+"""
+
+# Noms des utilisateurs classés (au plus 3 × limit identifiants)
+_SQL_USER_NAMES = "SELECT user_id, name FROM user_scores WHERE user_id IN ({placeholders})"
+
 class LeaderboardManager:
+    _MEDALS = ("🥇", "🥈", "🥉")
+    
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
+        # Derniers classements calculés par limite, servis pendant un recalcul en cours
+        self._last_leaderboards = {}  # limite -> (génération, classements)
+        self._generation = 0
+        self._computing = set()
+        self._computing_lock = threading.Lock()
     
-    def get_daily_leaderboard(self, limit: int = 10) -> List[Dict]:
-        """Classement du jour."""
-        cache_key = f"leaderboard_daily_{limit}"
-        cached = global_cache.get(cache_key)
-        if cached:
-            return cached
+    def _compute_all_leaderboards(self, limit: int) -> Dict[str, List[LeaderboardEntry]]:
+        """Calcule les classements du jour, de la semaine et du mois en une seule requête."""
+        now = datetime.now()
+        # Journée en intervalle semi-ouvert : pas de DATE() sur la colonne indexée
+        midnight = datetime.combine(now.date(), time.min)
+        day_start = int(midnight.timestamp())
+        day_end = int((midnight + timedelta(days=1)).timestamp())
+        week_start = int((now - timedelta(days=7)).timestamp())
+        month_start = int((now - timedelta(days=30)).timestamp())
         
-        try:
-            today = datetime.now().strftime('%Y-%m-%d')
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
             
-            with self.db.connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    SELECT ug.user_id, us.name,
-                           COUNT(*) as questions_today,
-                           SUM(CASE WHEN ug.is_correct THEN 1 ELSE 0 END) as correct_today,
-                           SUM(ug.stars_earned) as stars_today
-                    FROM user_grades ug
-                    JOIN user_scores us ON ug.user_id = us.user_id
-                    WHERE DATE(ug.answered_at) = ?
-                    GROUP BY ug.user_id, us.name
-                    ORDER BY stars_today DESC, correct_today DESC
-                    LIMIT ?
-                """, (today, limit))
-                
-                results = cursor.fetchall()
-                
-                leaderboard = []
-                for result in results:
-                    percentage = (result[3] / result[2]) * 100 if result[2] > 0 else 0
-                    leaderboard.append({
-                        'user_id': result[0],
-                        'name': result[1],
-                        'questions': result[2],
-                        'correct': result[3],
-                        'stars': result[4],
-                        'percentage': percentage
-                    })
-                
-                global_cache.set(cache_key, leaderboard, ttl=300)  # 5 minutes
-                return leaderboard
-                
-        except Exception as e:
-            logger.error(f"Erreur classement quotidien: {e}")
-            return []
+            cursor.execute(_SQL_ALL_LEADERBOARDS, {
+                'day_start': day_start, 'day_end': day_end,
+                'week': week_start, 'month': month_start, 'limit': limit
+            })
+            
+            rows = cursor.fetchall()
+            
+            user_ids = [row['user_id'] for row in rows]
+            names = {}
+            if user_ids:
+                cursor.execute(
+                    _SQL_USER_NAMES.format(placeholders=','.join('?' * len(user_ids))),
+                    user_ids
+                )
+                names = dict(cursor.fetchall())
+        
+        leaderboards = {}
+        for period in ('day', 'week', 'month'):
+            questions_col, correct_col, stars_col, percentage_col, rank_col = (
+                f'q_{period}', f'c_{period}', f's_{period}', f'p_{period}', f'rn_{period}'
+            )
+            entries = sorted(
+                (row for row in rows
+                 if row[rank_col] <= limit and row[questions_col] > 0 and row['user_id'] in names),
+                key=lambda row: row[rank_col]
+            )
+            leaderboards[period] = [
+                LeaderboardEntry(
+                    row['user_id'], names[row['user_id']], row[questions_col], row[correct_col],
+                    row[stars_col], row[percentage_col]
+                )
+                for row in entries
+            ]
+        return leaderboards
     
-    def get_weekly_leaderboard(self, limit: int = 10) -> List[Dict]:
-        """Classement de la semaine."""
-        cache_key = f"leaderboard_weekly_{limit}"
-        cached = global_cache.get(cache_key)
-        if cached:
-            return cached
+    def get_all_leaderboards(self, limit: int = 10, force: bool = False) -> Dict[str, List[LeaderboardEntry]]:
+        """Classements du jour, de la semaine et du mois (calculés ensemble, avec cache).
         
-        try:
-            week_start = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+        Cache expiré : la dernière valeur connue est servie tout de suite et le
+        recalcul part en arrière-plan. force recalcule immédiatement.
+        """
+        return self._get_leaderboards(limit, force)[1]
+    
+    def _get_leaderboards(self, limit: int, force: bool = False) -> Tuple[Optional[int], Dict[str, List[LeaderboardEntry]]]:
+        """Classements et génération du calcul dont ils proviennent (None si périmés)."""
+        if not force:
+            cached = global_cache.get(f"leaderboards_{limit}")
+            if cached is not None:
+                return cached
             
-            with self.db.connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    SELECT ug.user_id, us.name,
-                           COUNT(*) as questions_week,
-                           SUM(CASE WHEN ug.is_correct THEN 1 ELSE 0 END) as correct_week,
-                           SUM(ug.stars_earned) as stars_week
-                    FROM user_grades ug
-                    JOIN user_scores us ON ug.user_id = us.user_id
-                    WHERE ug.answered_at >= ?
-                    GROUP BY ug.user_id, us.name
-                    ORDER BY stars_week DESC, correct_week DESC
-                    LIMIT ?
-                """, (week_start, limit))
-                
-                results = cursor.fetchall()
-                
-                leaderboard = []
-                for result in results:
-                    percentage = (result[3] / result[2]) * 100 if result[2] > 0 else 0
-                    leaderboard.append({
-                        'user_id': result[0],
-                        'name': result[1],
-                        'questions': result[2],
-                        'correct': result[3],
-                        'stars': result[4],
-                        'percentage': percentage
-                    })
-                
-                global_cache.set(cache_key, leaderboard, ttl=600)  # 10 minutes
-                return leaderboard
-                
-        except Exception as e:
-            logger.error(f"Erreur classement hebdomadaire: {e}")
-            return []
+            last = self._last_leaderboards.get(limit)
+            if last is not None:
+                self._schedule_refresh(limit)
+                return None, last[1]
+        
+        return self._refresh(limit)
     
-    def get_monthly_leaderboard(self, limit: int = 10) -> List[Dict]:
-        """Classement du mois."""
-        cache_key = f"leaderboard_monthly_{limit}"
-        cached = global_cache.get(cache_key)
-        if cached:
-            return cached
+    def _schedule_refresh(self, limit: int):
+        """Lance le recalcul des classements dans un thread, sauf s'il est déjà en cours."""
+        with self._computing_lock:
+            if limit in self._computing:
+                return
+            self._computing.add(limit)
+        threading.Thread(target=self._refresh, args=(limit, True), daemon=True).start()
+    
+    def _refresh(self, limit: int, claimed: bool = False) -> Tuple[Optional[int], Dict[str, List[LeaderboardEntry]]]:
+        """Recalcule les classements et les met en cache (un seul calcul à la fois par limite)."""
+        owner = claimed
+        if not claimed:
+            # Les appels concurrents reçoivent la dernière valeur connue au lieu
+            # de relancer la même requête
+            with self._computing_lock:
+                owner = limit not in self._computing
+                if owner:
+                    self._computing.add(limit)
+                elif limit in self._last_leaderboards:
+                    return None, self._last_leaderboards[limit][1]
         
         try:
-            month_start = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-            
-            with self.db.connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    SELECT ug.user_id, us.name,
-                           COUNT(*) as questions_month,
-                           SUM(CASE WHEN ug.is_correct THEN 1 ELSE 0 END) as correct_month,
-                           SUM(ug.stars_earned) as stars_month
-                    FROM user_grades ug
-                    JOIN user_scores us ON ug.user_id = us.user_id
-                    WHERE ug.answered_at >= ?
-                    GROUP BY ug.user_id, us.name
-                    ORDER BY stars_month DESC, correct_month DESC
-                    LIMIT ?
-                """, (month_start, limit))
-                
-                results = cursor.fetchall()
-                
-                leaderboard = []
-                for result in results:
-                    percentage = (result[3] / result[2]) * 100 if result[2] > 0 else 0
-                    leaderboard.append({
-                        'user_id': result[0],
-                        'name': result[1],
-                        'questions': result[2],
-                        'correct': result[3],
-                        'stars': result[4],
-                        'percentage': percentage
-                    })
-                
-                global_cache.set(cache_key, leaderboard, ttl=1800)  # 30 minutes
-                return leaderboard
-                
+            leaderboards = self._compute_all_leaderboards(limit)
+            with self._computing_lock:
+                self._generation += 1
+                current = (self._generation, leaderboards)
+            previous = self._last_leaderboards.get(limit)
+            self._last_leaderboards[limit] = current
+            global_cache.set(f"leaderboards_{limit}", current, ttl=300)  # 5 minutes
+            # Les textes mis en forme à partir de l'ancienne valeur sont périmés
+            if previous is not None:
+                for period in ('daily', 'weekly', 'monthly'):
+                    global_cache.delete(f"lb_text_{period}_{limit}_{previous[0]}")
+            return current
         except Exception as e:
-            logger.error(f"Erreur classement mensuel: {e}")
-            return []
+            logger.error(f"Erreur calcul des classements: {e}")
+            last = self._last_leaderboards.get(limit)
+            return None, last[1] if last is not None else {'day': [], 'week': [], 'month': []}
+        finally:
+            if owner:
+                with self._computing_lock:
+                    self._computing.discard(limit)
+    
+    async def refresh_loop(self, limit: int = 10, interval: int = 300):
+        """Recalcule périodiquement les classements pour que les requêtes trouvent un cache chaud.
+        
+        Optionnelle : sans elle, un cache expiré est rafraîchi en arrière-plan
+        à la requête suivante.
+        """
+        while True:
+            try:
+                await asyncio.to_thread(self.get_all_leaderboards, limit, True)
+                await asyncio.sleep(interval)  # Toutes les 5 minutes
+            except Exception as e:
+                logger.error(f"Erreur rafraîchissement des classements: {e}")
+                await asyncio.sleep(60)  # Réessayer dans 1 minute
+    
+    def get_daily_leaderboard(self, limit: int = 10) -> List[LeaderboardEntry]:
+        """Classement du jour."""
+        return self.get_all_leaderboards(limit)['day']
+    
+    def get_weekly_leaderboard(self, limit: int = 10) -> List[LeaderboardEntry]:
+        """Classement de la semaine."""
+        return self.get_all_leaderboards(limit)['week']
+    
+    def get_monthly_leaderboard(self, limit: int = 10) -> List[LeaderboardEntry]:
+        """Classement du mois."""
+        return self.get_all_leaderboards(limit)['month']
     
     def get_leaderboard_text(self, period: str, limit: int = 10) -> str:
         """Génère le texte d'affichage du classement."""
+        generation, leaderboards = self._get_leaderboards(limit)
+        if generation is None:
+            # Classements périmés en attente de recalcul : texte non mis en cache
+            return self._format_leaderboard_text(period, leaderboards)
+        
+        # Texte lié à la génération des classements dont il provient : un recalcul
+        # concurrent ne peut pas lui faire survivre des données plus récentes
+        cache_key = f"lb_text_{period}_{limit}_{generation}"
+        cached = global_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        text = self._format_leaderboard_text(period, leaderboards)
+        global_cache.set(cache_key, text, ttl=300)  # 5 minutes
+        return text
+    
+    def _format_leaderboard_text(self, period: str, leaderboards: Dict[str, List[LeaderboardEntry]]) -> str:
+        """Met en forme le classement d'une période."""
         if period == "daily":
-            leaderboard = self.get_daily_leaderboard(limit)
+            leaderboard = leaderboards['day']
             title = "🏆 **CLASSEMENT DU JOUR** 🏆"
             period_text = "aujourd'hui"
         elif period == "weekly":
-            leaderboard = self.get_weekly_leaderboard(limit)
+            leaderboard = leaderboards['week']
             title = "🏆 **CLASSEMENT DE LA SEMAINE** 🏆"
             period_text = "cette semaine"
         elif period == "monthly":
-            leaderboard = self.get_monthly_leaderboard(limit)
+            leaderboard = leaderboards['month']
             title = "🏆 **CLASSEMENT DU MOIS** 🏆"
             period_text = "ce mois"
         else:
@@ -172,19 +242,14 @@ class LeaderboardManager:
         if not leaderboard:
             return f"📊 **Aucune activité {period_text}**\n\nParticipez aux quiz pour apparaître dans le classement !"
         
-        text = f"{title}\n\n"
-        medals = ["🥇", "🥈", "🥉"]
+        parts = [f"{title}\n\n"]
+        for rank, user in enumerate(leaderboard, 1):
+            medal = self._MEDALS[rank - 1] if rank <= len(self._MEDALS) else "🏅"
+            parts.append(
+                f"{medal} **{rank}.** {user.name}\n"
+                f"   ✅ {user.correct}/{user.questions} questions"
+                f" | 🌟 {user.stars} étoiles"
+                f" | 📊 {user.percentage:.1f}%\n\n"
+            )
         
-        for i, user in enumerate(leaderboard):
-            rank = i + 1
-            if rank <= 3:
-                medal = medals[rank - 1]
-                text += f"{medal} **{rank}.** {user['name']}\n"
-            else:
-                text += f"🏅 **{rank}.** {user['name']}\n"
-            
-            text += f"   ✅ {user['correct']}/{user['questions']} questions"
-            text += f" | 🌟 {user['stars']} étoiles"
-            text += f" | 📊 {user['percentage']:.1f}%\n\n"
-        
-        return text
+        return ''.join(parts)
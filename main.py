@@ -1,5 +1,6 @@
 
 import os
+import glob
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Poll
 from telegram.constants import ParseMode, ChatType
@@ -11,33 +12,92 @@ from telegram.ext import (
     ContextTypes,
     JobQueue
 )
+from telegram.request import HTTPXRequest
 import json
 import random
 from datetime import datetime, time
 import pytz
 import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from heapq import nlargest
+from operator import itemgetter
 from typing import Dict, Set, Tuple, Optional
 
 from pdf_manager import PDFManager
 
+# orjson (optionnel) : analyse et sérialisation JSON en C, repli sur json sinon
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configuration du logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _read_json(path: str):
+    """Lit un fichier JSON en une fois (octets bruts, sans décodage préalable)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def _write_json(path: str, obj, indent: bool = False):
+    """Écrit un objet JSON directement en octets."""
+    if orjson:
+        payload = orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    else:
+        payload = json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(payload)
+
+def _json_line(obj) -> str:
+    """Sérialise un objet en une ligne JSON compacte."""
+    if orjson:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+@dataclass(slots=True)
+class PollInfo:
+    """Poll de quiz en cours, indexé par identifiant de poll."""
+    group_id: int
+    question_number: int
+    correct_option_id: int
+
+@dataclass(slots=True)
+class QuizSession:
+    """Quiz en cours dans un groupe."""
+    session_id: str
+    questions: list
+    total_questions: int
+    is_daily: bool = False
+    current_question: int = 0
+    participants: Set = field(default_factory=set)
+
 class BotState:
     """Classe pour gérer l'état global du bot."""
     def __init__(self):
-        self.quiz_sessions: Dict = {}
+        self.quiz_sessions: Dict[int, QuizSession] = {}
         self.group_scores: Dict = {}
-        self.active_polls: Dict = {}
+        self.active_polls: Dict[str, PollInfo] = {}
         self.active_groups: Set = set()
+        # Groupes actifs modifiés depuis la dernière écriture (sauvegarde différée)
+        self.active_groups_dirty = False
         self.questions_data: list = []
         self.motivational_quotes: list = []
+        # Générateur aléatoire des quiz (tirage des questions, ordre des options)
+        self.rng = random.Random()
         
         # Configuration
         self.TELEGRAM_TOKEN = os.getenv("TOKEN")
         self.BOT_CREATOR_ID = int(os.getenv("BOT_CREATOR_ID", "6692408502"))
         
+        # Pools HTTP séparés : les envois (quiz, messages) n'attendent jamais
+        # les connexions occupées par le long polling de getUpdates
+        self.HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+        self.UPDATES_POOL_SIZE = int(os.getenv("UPDATES_POOL_SIZE", "4"))
+        self.HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10.0"))
+        
         # Canaux et groupes obligatoires
         self.REQUIRED_CHANNEL = "@kabro_edu"
         self.REQUIRED_GROUP = "@kabroedu"
@@ -47,6 +107,15 @@ class BotState:
         # Fichiers de sauvegarde
         self.SCORES_FILE = 'group_scores.json'
         self.ACTIVE_GROUPS_FILE = 'active_groups.json'
+        # Journal des variations de score (une ligne par réponse), compacté dans SCORES_FILE
+        self.SCORES_JOURNAL_FILE = 'group_scores.jsonl'
+        self.SCORES_COMPACTION_INTERVAL = 3600  # 1 heure
+        
+        # Prénoms résolus via get_chat_member : (group_id, user_id) -> (nom, expiration),
+        # dans l'ordre d'accès pour évincer les moins récemment utilisés
+        self.name_cache: OrderedDict = OrderedDict()
+        self.NAME_CACHE_TTL = 6 * 3600  # 6 heures
+        self.NAME_CACHE_MAXSIZE = int(os.getenv("NAME_CACHE_MAXSIZE", "5000"))
         
         # Initialiser le gestionnaire PDF
         self.pdf_manager = PDFManager()
@@ -132,13 +201,22 @@ class DataManager:
     
     def __init__(self, bot_state: BotState):
         self.bot_state = bot_state
+        # Fichier journal ouvert en ajout, gardé ouvert entre deux compactions
+        self._journal = None
+        # Lignes reçues pendant une rotation du journal (None hors rotation)
+        self._journal_backlog = None
+        self._last_compaction = datetime.now()
+        # Numéro du dernier journal mis de côté (group_scores.jsonl.<n>) ; l'instantané
+        # enregistre le numéro qu'il couvre
+        self._journal_seq = 0
+        # Une seule sauvegarde à la fois (sauvegarde périodique et sauvegarde finale)
+        self._save_lock = asyncio.Lock()
     
     def load_motivational_quotes(self):
         """Charge les citations motivantes depuis citations_motivantes.json"""
         try:
-            with open('citations_motivantes.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.bot_state.motivational_quotes = data.get('citations', [])
+            data = _read_json('citations_motivantes.json')
+            self.bot_state.motivational_quotes = data.get('citations', [])
             logger.info(f"Chargé {len(self.bot_state.motivational_quotes)} citations motivantes")
         except FileNotFoundError:
             logger.warning("Fichier citations_motivantes.json introuvable")
@@ -163,9 +241,15 @@ class DataManager:
     def load_questions(self):
         """Charge les questions depuis questions.json"""
         try:
-            with open('questions.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.bot_state.questions_data = data.get('histoire_geographie', [])
+            data = _read_json('questions.json')
+            self.bot_state.questions_data = data.get('histoire_geographie', [])
+            
+            # Troncature faite une fois au chargement plutôt qu'à chaque envoi de question
+            for question_data in self.bot_state.questions_data:
+                if len(question_data.get('question', '')) > 200:
+                    question_data['question'] = question_data['question'][:200] + "..."
+                if len(question_data.get('explanation', '')) > 150:
+                    question_data['explanation'] = question_data['explanation'][:150] + "..."
             logger.info(f"Chargé {len(self.bot_state.questions_data)} questions")
             
             if not self.bot_state.questions_data:
@@ -180,24 +264,115 @@ class DataManager:
             logger.error(f"Erreur chargement questions: {e}")
             self.bot_state.questions_data = []
     
-    def save_scores(self):
-        """Sauvegarde les scores dans un fichier JSON."""
+    def record_score_delta(self, group_id: int, user_id: int, delta: int):
+        """Ajoute une variation de score au journal (une ligne JSON compacte)."""
+        self._append_journal((_json_line({'g': group_id, 'u': user_id, 'd': delta}) + '\n').encode('utf-8'))
+    
+    def _append_journal(self, line: bytes):
+        """Écrit une ligne déjà sérialisée dans le journal courant."""
+        if self._journal_backlog is not None:
+            # Rotation en cours dans un thread : ligne reportée dans le nouveau journal
+            self._journal_backlog.append(line)
+            return
         try:
-            scores_to_save = {}
-            for group_id, users in self.bot_state.group_scores.items():
-                scores_to_save[str(group_id)] = {str(user_id): score for user_id, score in users.items()}
-            
-            with open(self.bot_state.SCORES_FILE, 'w', encoding='utf-8') as f:
-                json.dump(scores_to_save, f, indent=2)
-            logger.info(f"Scores sauvegardés pour {len(self.bot_state.group_scores)} groupes")
+            if self._journal is None:
+                self._journal = open(self.bot_state.SCORES_JOURNAL_FILE, 'ab')
+            # Écriture tamponnée, sans flush par ligne : le tampon est vidé à chaque
+            # sauvegarde périodique, à la compaction et à l'arrêt
+            self._journal.write(line)
         except Exception as e:
-            logger.error(f"Erreur sauvegarde scores: {e}")
+            logger.error(f"Erreur écriture journal des scores: {e}")
+    
+    async def flush_score_journal(self):
+        """Vide le tampon du journal sur disque (hors de la boucle d'événements)."""
+        if self._journal is not None:
+            await asyncio.to_thread(self._journal.flush)
+    
+    async def save_scores(self):
+        """Compacte les scores : réécrit l'instantané JSON puis vide le journal.
+        
+        La copie des scores se fait sur la boucle d'événements ; la rotation du
+        journal et l'écriture disque partent dans un thread, sans bloquer les
+        appels Telegram en cours.
+        """
+        # Protégée de l'annulation : un thread lancé ne s'arrête pas avec la tâche
+        # appelante, le verrou doit rester pris jusqu'à la fin de la compaction
+        await asyncio.shield(self._compact_scores())
+    
+    async def _compact_scores(self):
+        """Corps de save_scores, exécuté sous le verrou de sauvegarde."""
+        async with self._save_lock:
+            try:
+                scores_to_save = {}
+                for group_id, users in self.bot_state.group_scores.items():
+                    scores_to_save[str(group_id)] = {str(user_id): score for user_id, score in users.items()}
+                
+                # Les réponses reçues pendant la rotation vont dans le nouveau journal
+                journal, self._journal = self._journal, None
+                self._journal_backlog = []
+                self._journal_seq += 1
+                seq = self._journal_seq
+                try:
+                    await asyncio.to_thread(self._rotate_score_journal, journal, seq)
+                finally:
+                    backlog, self._journal_backlog = self._journal_backlog, None
+                    for line in backlog:
+                        self._append_journal(line)
+                
+                await asyncio.to_thread(self._save_scores_sync, scores_to_save, seq)
+                
+                self._last_compaction = datetime.now()
+                logger.info(f"Scores sauvegardés pour {len(scores_to_save)} groupes")
+            except Exception as e:
+                logger.error(f"Erreur sauvegarde scores: {e}")
+    
+    def _rotate_score_journal(self, journal, seq: int):
+        """Met de côté le journal courant sous le numéro seq, couvert par l'instantané en cours."""
+        if journal is not None:
+            journal.close()
+        
+        journal_file = self.bot_state.SCORES_JOURNAL_FILE
+        if os.path.exists(journal_file):
+            os.replace(journal_file, f"{journal_file}.{seq}")
+    
+    def _rotated_journals(self):
+        """Journaux mis de côté, triés par numéro : liste de (numéro, chemin)."""
+        journal_file = self.bot_state.SCORES_JOURNAL_FILE
+        rotated = []
+        for path in glob.glob(glob.escape(journal_file) + '.*'):
+            suffix = path[len(journal_file) + 1:]
+            if suffix.isdigit():
+                rotated.append((int(suffix), path))
+        rotated.sort()
+        return rotated
+    
+    def _save_scores_sync(self, scores_to_save: Dict, seq: int):
+        """Écrit l'instantané des scores (exécuté hors de la boucle d'événements)."""
+        # Écriture dans un fichier temporaire puis remplacement atomique : un arrêt
+        # en pleine écriture ne laisse jamais un instantané tronqué. Le numéro du
+        # dernier journal couvert est écrit avec les scores : un arrêt avant la
+        # suppression des journaux ne les fait pas rejouer une seconde fois
+        tmp_file = self.bot_state.SCORES_FILE + '.tmp'
+        _write_json(tmp_file, {'journal_seq': seq, 'groups': scores_to_save}, indent=True)
+        os.replace(tmp_file, self.bot_state.SCORES_FILE)
+        
+        # L'instantané contient désormais toutes les variations mises de côté, y compris
+        # celles d'une compaction précédente en échec (numéros inférieurs)
+        for number, path in self._rotated_journals():
+            if number <= seq:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
     
     def load_scores(self):
-        """Charge les scores depuis le fichier JSON."""
+        """Charge l'instantané des scores puis rejoue le journal des variations."""
+        snapshot_seq = 0
         try:
-            with open(self.bot_state.SCORES_FILE, 'r', encoding='utf-8') as f:
-                scores_data = json.load(f)
+            scores_data = _read_json(self.bot_state.SCORES_FILE)
+            if 'groups' in scores_data:
+                snapshot_seq = scores_data.get('journal_seq', 0)
+                scores_data = scores_data['groups']
             
             self.bot_state.group_scores = {}
             for group_id_str, users in scores_data.items():
@@ -211,21 +386,64 @@ class DataManager:
         except Exception as e:
             logger.error(f"Erreur chargement scores: {e}")
             self.bot_state.group_scores = {}
+        
+        self._replay_score_journal(snapshot_seq)
     
-    def save_active_groups(self):
-        """Sauvegarde la liste des groupes actifs."""
-        try:
-            with open(self.bot_state.ACTIVE_GROUPS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(list(self.bot_state.active_groups), f)
-            logger.info(f"Groupes actifs sauvegardés: {len(self.bot_state.active_groups)} groupes")
-        except Exception as e:
-            logger.error(f"Erreur sauvegarde groupes actifs: {e}")
+    def _replay_score_journal(self, snapshot_seq: int = 0):
+        """Applique aux scores chargés les variations journalisées depuis la dernière compaction."""
+        replayed = 0
+        # Journaux mis de côté par une compaction interrompue, sauf ceux que l'instantané
+        # couvre déjà (numéro <= snapshot_seq), puis journal courant
+        rotated = self._rotated_journals()
+        self._journal_seq = max([snapshot_seq] + [number for number, _ in rotated])
+        paths = [path for number, path in rotated if number > snapshot_seq]
+        for path in paths + [self.bot_state.SCORES_JOURNAL_FILE]:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = orjson.loads(line) if orjson else json.loads(line)
+                        except json.JSONDecodeError:
+                            # Dernière ligne incomplète après un arrêt brutal
+                            continue
+                        users = self.bot_state.group_scores.setdefault(entry['g'], {})
+                        users[entry['u']] = users.get(entry['u'], 0) + entry['d']
+                        replayed += 1
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"Erreur relecture journal des scores: {e}")
+        
+        if replayed:
+            logger.info(f"{replayed} variations de score rejouées depuis le journal")
+    
+    async def save_active_groups(self):
+        """Sauvegarde la liste des groupes actifs (écriture dans un thread)."""
+        # Même fichier temporaire pour toutes les sauvegardes : pas d'écritures concurrentes
+        await asyncio.shield(self._write_active_groups())
+    
+    async def _write_active_groups(self):
+        """Corps de save_active_groups, exécuté sous le verrou de sauvegarde."""
+        async with self._save_lock:
+            try:
+                groups = list(self.bot_state.active_groups)
+                self.bot_state.active_groups_dirty = False
+                await asyncio.to_thread(self._save_active_groups_sync, groups)
+                logger.info(f"Groupes actifs sauvegardés: {len(groups)} groupes")
+            except Exception as e:
+                self.bot_state.active_groups_dirty = True
+                logger.error(f"Erreur sauvegarde groupes actifs: {e}")
+    
+    def _save_active_groups_sync(self, groups: list):
+        """Écrit la liste des groupes actifs via un fichier temporaire."""
+        tmp_file = self.bot_state.ACTIVE_GROUPS_FILE + '.tmp'
+        _write_json(tmp_file, groups)
+        os.replace(tmp_file, self.bot_state.ACTIVE_GROUPS_FILE)
     
     def load_active_groups(self):
         """Charge la liste des groupes actifs."""
         try:
-            with open(self.bot_state.ACTIVE_GROUPS_FILE, 'r', encoding='utf-8') as f:
-                active_groups_list = json.load(f)
+            active_groups_list = _read_json(self.bot_state.ACTIVE_GROUPS_FILE)
             self.bot_state.active_groups = set(active_groups_list)
             logger.info(f"Groupes actifs chargés: {len(self.bot_state.active_groups)} groupes")
         except FileNotFoundError:
@@ -239,8 +457,15 @@ class DataManager:
         """Sauvegarde périodique des données."""
         while True:
             try:
-                self.save_scores()
-                self.save_active_groups()
+                # Les scores sont journalisés à chaque réponse : compaction seulement toutes les heures
+                elapsed = (datetime.now() - self._last_compaction).total_seconds()
+                if elapsed >= self.bot_state.SCORES_COMPACTION_INTERVAL:
+                    await self.save_scores()
+                else:
+                    await self.flush_score_journal()
+                # Les ajouts/retraits de groupes sont regroupés en une écriture
+                if self.bot_state.active_groups_dirty:
+                    await self.save_active_groups()
                 await asyncio.sleep(300)  # Toutes les 5 minutes
             except Exception as e:
                 logger.error(f"Erreur sauvegarde périodique: {e}")
@@ -259,7 +484,7 @@ class QuizManager:
             return []
         
         available_count = min(count, len(self.bot_state.questions_data))
-        return random.sample(self.bot_state.questions_data, available_count)
+        return self.bot_state.rng.sample(self.bot_state.questions_data, available_count)
     
     async def start_quiz_in_group(self, context: ContextTypes.DEFAULT_TYPE, group_id: int, 
                                   trigger_message=None, is_daily=False):
@@ -287,7 +512,9 @@ class QuizManager:
                 self.bot_state.group_scores[group_id] = {}
 
             # Ajouter le groupe aux groupes actifs
-            self.bot_state.active_groups.add(group_id)
+            if group_id not in self.bot_state.active_groups:
+                self.bot_state.active_groups.add(group_id)
+                self.bot_state.active_groups_dirty = True
 
             # Sélectionner 3 questions aléatoirement
             selected_questions = self.get_random_questions(3)
@@ -302,14 +529,12 @@ class QuizManager:
 
             # Créer la session de quiz
             session_id = f"{'daily_' if is_daily else ''}quiz_{group_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            self.bot_state.quiz_sessions[group_id] = {
-                'session_id': session_id,
-                'questions': selected_questions,
-                'current_question': 0,
-                'total_questions': len(selected_questions),
-                'participants': set(),
-                'is_daily': is_daily
-            }
+            self.bot_state.quiz_sessions[group_id] = QuizSession(
+                session_id=session_id,
+                questions=selected_questions,
+                total_questions=len(selected_questions),
+                is_daily=is_daily
+            )
 
             # Message d'introduction
             intro_text = (
@@ -336,47 +561,33 @@ class QuizManager:
     async def send_quiz_question(self, context: ContextTypes.DEFAULT_TYPE, group_id: int):
         """Envoie une question de quiz."""
         try:
-            if group_id not in self.bot_state.quiz_sessions:
+            session = self.bot_state.quiz_sessions.get(group_id)
+            if session is None:
                 return
 
-            session = self.bot_state.quiz_sessions[group_id]
-            current_q = session['current_question']
+            current_q = session.current_question
 
-            if current_q >= session['total_questions']:
+            if current_q >= session.total_questions:
                 await self.end_quiz(context, group_id)
                 return
 
-            question_data = session['questions'][current_q].copy()
-
-            # Limiter la longueur de la question et de l'explication
+            # Question et explication déjà tronquées au chargement (DataManager.load_questions)
+            question_data = session.questions[current_q]
             question_text = question_data['question']
-            if len(question_text) > 200:
-                question_text = question_data['question'][:200] + "..."
-
             explanation = question_data['explanation']
-            if len(explanation) > 150:
-                explanation = question_data['explanation'][:150] + "..."
 
-            # Mélanger les options
-            original_options = question_data['options'].copy()
-            original_correct_id = question_data['correct_option_id']
-            correct_answer = original_options[original_correct_id]
-
-            options_with_indices = list(enumerate(original_options))
-            random.shuffle(options_with_indices)
-
-            shuffled_options = []
-            new_correct_id = 0
-
-            for new_index, (old_index, option) in enumerate(options_with_indices):
-                shuffled_options.append(option)
-                if old_index == original_correct_id:
-                    new_correct_id = new_index
+            # Mélanger les options : une permutation des indices, dont on relit
+            # directement la nouvelle position de la bonne réponse
+            original_options = question_data['options']
+            permutation = list(range(len(original_options)))
+            self.bot_state.rng.shuffle(permutation)
+            shuffled_options = [original_options[i] for i in permutation]
+            new_correct_id = permutation.index(question_data['correct_option_id'])
 
             # Envoyer le poll
             poll_message = await context.bot.send_poll(
                 chat_id=group_id,
-                question=f"❓ Q{current_q + 1}/{session['total_questions']} - {question_text}",
+                question=f"❓ Q{current_q + 1}/{session.total_questions} - {question_text}",
                 options=shuffled_options,
                 type=Poll.QUIZ,
                 correct_option_id=new_correct_id,
@@ -387,47 +598,98 @@ class QuizManager:
             )
 
             # Sauvegarder le poll actif
-            self.bot_state.active_polls[poll_message.poll.id] = {
-                'group_id': group_id,
-                'question_number': current_q + 1,
-                'correct_option_id': new_correct_id
-            }
-
-            # Programmer la question suivante ou la fin
-            if current_q + 1 < session['total_questions']:
-                asyncio.create_task(self._delayed_next_question(context, group_id))
-            else:
-                asyncio.create_task(self._delayed_quiz_end(context, group_id))
+            self.bot_state.active_polls[poll_message.poll.id] = PollInfo(
+                group_id=group_id,
+                question_number=current_q + 1,
+                correct_option_id=new_correct_id
+            )
+
+            # Programmer la question suivante ou la fin (une seule entrée planifiée par quiz)
+            self._schedule_next_step(context, group_id)
 
             logger.info(f"Question {current_q + 1} envoyée au groupe {group_id}")
 
         except Exception as e:
             logger.error(f"Erreur envoi question: {e}")
     
+    @staticmethod
+    def _quiz_job_name(group_id: int) -> str:
+        """Nom du job JobQueue portant l'étape suivante du quiz d'un groupe."""
+        return f"quiz_next_{group_id}"
+    
+    def _schedule_next_step(self, context: ContextTypes.DEFAULT_TYPE, group_id: int):
+        """Programme la question suivante (ou la fin du quiz) dans 32 secondes."""
+        if context.job_queue:
+            context.job_queue.run_once(
+                self._job_next_question,
+                when=32,
+                data=group_id,
+                name=self._quiz_job_name(group_id)
+            )
+        else:
+            asyncio.create_task(self._delayed_next_question(context, group_id))
+    
+    def _cancel_scheduled_steps(self, context: ContextTypes.DEFAULT_TYPE, group_id: int):
+        """Retire les étapes encore planifiées pour le quiz d'un groupe."""
+        if context.job_queue:
+            for job in context.job_queue.get_jobs_by_name(self._quiz_job_name(group_id)):
+                job.schedule_removal()
+    
+    async def _job_next_question(self, context: ContextTypes.DEFAULT_TYPE):
+        """Callback JobQueue : passe à la question suivante (la fin au-delà de la dernière)."""
+        await self._send_next_question(context, context.job.data)
+    
     async def _delayed_next_question(self, context: ContextTypes.DEFAULT_TYPE, group_id: int):
-        """Envoie la prochaine question après 32 secondes."""
+        """Envoie la prochaine question après 32 secondes (sans JobQueue)."""
         await asyncio.sleep(32)
         await self._send_next_question(context, group_id)
     
-    async def _delayed_quiz_end(self, context: ContextTypes.DEFAULT_TYPE, group_id: int):
-        """Termine le quiz après 32 secondes."""
-        await asyncio.sleep(32)
-        await self.end_quiz(context, group_id)
-    
     async def _send_next_question(self, context: ContextTypes.DEFAULT_TYPE, group_id: int):
-        """Passe à la question suivante."""
-        if group_id in self.bot_state.quiz_sessions:
-            self.bot_state.quiz_sessions[group_id]['current_question'] += 1
+        """Passe à la question suivante ; send_quiz_question termine le quiz après la dernière."""
+        session = self.bot_state.quiz_sessions.get(group_id)
+        if session is not None:
+            session.current_question += 1
             await self.send_quiz_question(context, group_id)
     
+    async def resolve_user_name(self, context: ContextTypes.DEFAULT_TYPE, group_id: int, user_id: int) -> str:
+        """Retourne le prénom d'un membre du groupe, mis en cache quelques heures."""
+        key = (group_id, user_id)
+        now = datetime.now().timestamp()
+        name_cache = self.bot_state.name_cache
+        cached = name_cache.get(key)
+        if cached:
+            if cached[1] > now:
+                name_cache.move_to_end(key)
+                return cached[0]
+            del name_cache[key]
+
+        try:
+            user = await context.bot.get_chat_member(group_id, user_id)
+            name = user.user.first_name or "Utilisateur"
+        except Exception:
+            # Échec non mis en cache : nouvel essai au prochain affichage
+            return "Utilisateur"
+
+        name_cache[key] = (name, now + self.bot_state.NAME_CACHE_TTL)
+        name_cache.move_to_end(key)
+        while len(name_cache) > self.bot_state.NAME_CACHE_MAXSIZE:
+            name_cache.popitem(last=False)
+        return name
+
+    async def resolve_user_names(self, context: ContextTypes.DEFAULT_TYPE, group_id: int, user_ids) -> list:
+        """Résout plusieurs prénoms en parallèle (appels manquants lancés ensemble)."""
+        return await asyncio.gather(
+            *(self.resolve_user_name(context, group_id, user_id) for user_id in user_ids)
+        )
+
     async def end_quiz(self, context: ContextTypes.DEFAULT_TYPE, group_id: int):
         """Termine le quiz et affiche les résultats."""
         try:
-            if group_id not in self.bot_state.quiz_sessions:
+            session = self.bot_state.quiz_sessions.get(group_id)
+            if session is None:
                 return
 
-            session = self.bot_state.quiz_sessions[group_id]
-            participants = session['participants']
+            participants = session.participants
 
             if not participants:
                 await context.bot.send_message(
@@ -435,24 +697,15 @@ class QuizManager:
                     text="🎯 QUIZ TERMINÉ 🎯\n\n❌ Aucune participation enregistrée."
                 )
             else:
-                # Créer le classement pour ce quiz
-                results = []
-                for user_id in participants:
-                    score = self.bot_state.group_scores[group_id].get(user_id, 0)
-                    try:
-                        user = await context.bot.get_chat_member(group_id, user_id)
-                        name = user.user.first_name or "Utilisateur"
-                    except:
-                        name = "Utilisateur"
-
-                    results.append((name, score))
-
-                # Trier par score décroissant
-                results.sort(key=lambda x: x[1], reverse=True)
+                # Créer le classement pour ce quiz (top 5 par tas, noms résolus pour ce top 5 seulement)
+                group_scores = self.bot_state.group_scores[group_id]
+                top = nlargest(5, participants, key=lambda uid: group_scores.get(uid, 0))
+                names = await self.resolve_user_names(context, group_id, top)
+                results = [(name, group_scores.get(uid, 0)) for name, uid in zip(names, top)]
 
                 result_text = "🏆 RÉSULTATS DU QUIZ 🏆\n\n"
 
-                for i, (name, score) in enumerate(results[:5]):  # Top 5
+                for i, (name, score) in enumerate(results):  # Top 5
                     if i == 0:
                         emoji = "🥇"
                     elif i == 1:
@@ -468,8 +721,9 @@ class QuizManager:
 
                 await context.bot.send_message(chat_id=group_id, text=result_text)
 
-            # Nettoyer la session
+            # Nettoyer la session et les étapes encore planifiées
             del self.bot_state.quiz_sessions[group_id]
+            self._cancel_scheduled_steps(context, group_id)
 
             logger.info(f"Quiz terminé pour le groupe {group_id}")
 
@@ -553,9 +807,10 @@ class EducationalBot:
             if group_id not in self.state.group_scores:
                 self.state.group_scores[group_id] = {}
 
-            # Ajouter le groupe aux groupes actifs
-            self.state.active_groups.add(group_id)
-            self.data_manager.save_active_groups()
+            # Ajouter le groupe aux groupes actifs (persisté par la sauvegarde périodique)
+            if group_id not in self.state.active_groups:
+                self.state.active_groups.add(group_id)
+                self.state.active_groups_dirty = True
 
             start_text = (
                 "🎯 QUIZ ÉDUCATIF ACTIVÉ DANS CE GROUPE 🎯\n\n"
@@ -621,19 +876,11 @@ class EducationalBot:
             )
             return
 
-        # Créer le classement
-        results = []
-        for user_id, score in self.state.group_scores[group_id].items():
-            try:
-                user = await context.bot.get_chat_member(group_id, user_id)
-                name = user.user.first_name or "Utilisateur"
-            except:
-                name = "Utilisateur"
-
-            results.append((name, score))
-
-        # Trier par score décroissant
-        results.sort(key=lambda x: x[1], reverse=True)
+        # Créer le classement (scores triés, noms résolus pour le top 10 seulement)
+        group_scores = self.state.group_scores[group_id]
+        top = nlargest(10, group_scores.items(), key=itemgetter(1))
+        names = await self.quiz_manager.resolve_user_names(context, group_id, [user_id for user_id, _ in top])
+        results = [(name, score) for name, (_, score) in zip(names, top)]
 
         scores_text = "🏆 CLASSEMENT DU GROUPE 🏆\n\n"
 
@@ -649,7 +896,7 @@ class EducationalBot:
 
             scores_text += f"{emoji} {name} - {score} points\n"
 
-        scores_text += f"\n📊 {len(results)} participants au total"
+        scores_text += f"\n📊 {len(group_scores)} participants au total"
 
         await update.message.reply_text(scores_text)
     
@@ -659,27 +906,35 @@ class EducationalBot:
         poll_id = poll_answer.poll_id
         user_id = poll_answer.user.id
 
-        if poll_id not in self.state.active_polls:
+        poll_info = self.state.active_polls.get(poll_id)
+        if poll_info is None:
             return
 
-        poll_info = self.state.active_polls[poll_id]
-        group_id = poll_info['group_id']
-        correct_option_id = poll_info['correct_option_id']
+        group_id = poll_info.group_id
+        correct_option_id = poll_info.correct_option_id
 
-        if group_id not in self.state.quiz_sessions:
+        session = self.state.quiz_sessions.get(group_id)
+        if session is None:
             return
 
         # Ajouter le participant
-        self.state.quiz_sessions[group_id]['participants'].add(user_id)
+        session.participants.add(user_id)
 
         # Initialiser le score de l'utilisateur pour ce groupe
-        if user_id not in self.state.group_scores[group_id]:
+        is_new = user_id not in self.state.group_scores[group_id]
+        if is_new:
             self.state.group_scores[group_id][user_id] = 0
 
         # Vérifier si la réponse est correcte
+        delta = 0
         if poll_answer.option_ids and poll_answer.option_ids[0] == correct_option_id:
             self.state.group_scores[group_id][user_id] += 1
+            delta = 1
             logger.info(f"Utilisateur {user_id} a répondu correctement dans le groupe {group_id}")
+
+        # Journaliser la variation (ou l'arrivée d'un participant) plutôt que tout réécrire
+        if delta or is_new:
+            self.data_manager.record_score_delta(group_id, user_id, delta)
     
     async def daily_quiz_job(self, context: ContextTypes.DEFAULT_TYPE):
         """Job qui lance le quiz quotidien à 21h00."""
@@ -710,6 +965,7 @@ class EducationalBot:
                 except Exception as e:
                     logger.error(f"Erreur envoi quiz quotidien groupe {group_id}: {e}")
                     self.state.active_groups.discard(group_id)
+                    self.state.active_groups_dirty = True
 
             logger.info(f"Quiz quotidien lancé dans {successful_groups}/{len(self.state.active_groups)} groupes")
 
@@ -728,6 +984,8 @@ class EducationalBot:
                 inactive_groups.add(group_id)
         
         self.state.active_groups -= inactive_groups
+        if inactive_groups:
+            self.state.active_groups_dirty = True
         
         if inactive_groups:
             logger.info(f"Nettoyage terminé : {len(inactive_groups)} groupes supprimés")
@@ -1052,7 +1310,19 @@ class EducationalBot:
         self.data_manager.load_active_groups()
 
         try:
-            application = Application.builder().token(self.state.TELEGRAM_TOKEN).build()
+            application = (
+                Application.builder()
+                .token(self.state.TELEGRAM_TOKEN)
+                .request(HTTPXRequest(
+                    connection_pool_size=self.state.HTTP_POOL_SIZE,
+                    pool_timeout=self.state.HTTP_POOL_TIMEOUT
+                ))
+                .get_updates_request(HTTPXRequest(
+                    connection_pool_size=self.state.UPDATES_POOL_SIZE,
+                    pool_timeout=self.state.HTTP_POOL_TIMEOUT
+                ))
+                .build()
+            )
 
             # Commandes
             application.add_handler(CommandHandler("start", self.start_command))
@@ -1103,8 +1373,8 @@ class EducationalBot:
                 if self.save_task:
                     self.save_task.cancel()
                 logger.info("Sauvegarde finale des données...")
-                self.data_manager.save_scores()
-                self.data_manager.save_active_groups()
+                await self.data_manager.save_scores()
+                await self.data_manager.save_active_groups()
                 logger.info("Données sauvegardées avec succès")
                 
                 # Arrêter proprement l'application
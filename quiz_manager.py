@@ -296,9 +296,7 @@ class QuizManager:
     def update_daily_session_participant(self, session_id: str, user_id: int):
         """Ajoute un participant à une session de quiz quotidien."""
         try:
-            session = self.db.get_daily_quiz_session(session_id)
-            if session:
-                session['participants'].add(user_id)
-                self.db.update_daily_quiz_session_participants(session_id, session['participants'])
+            # Insertion d'une seule ligne, ignorée si la session n'existe pas
+            self.db.add_participant(session_id, user_id)
         except Exception as e:
             logger.error(f"Erreur ajout participant session {session_id}: {e}")
@@ -5,7 +5,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from user_manager import UserManager
-from config import SPAM_KEYWORDS, MAX_WARNINGS, MESSAGES
+from config import SPAM_KEYWORDS, SPAM_KEYWORDS_RE, MAX_WARNINGS, MESSAGES, compile_spam_keywords
 
 logger = logging.getLogger(__name__)
 
@@ -13,14 +13,14 @@ class SpamManager:
     def __init__(self, user_manager: UserManager):
         self.user_manager = user_manager
         self.spam_keywords = SPAM_KEYWORDS
+        self._spam_re = SPAM_KEYWORDS_RE
     
     def is_spam(self, text: str) -> bool:
         """Vérifie si un texte contient des mots-clés de spam."""
         if not text:
             return False
         
-        text_lower = text.lower()
-        return any(keyword in text_lower for keyword in self.spam_keywords)
+        return self._spam_re.search(text) is not None
     
     async def handle_spam_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
         """Gère un message de spam détecté. Retourne True si c'était du spam."""
@@ -92,12 +92,14 @@ class SpamManager:
         """Ajoute un mot-clé de spam."""
         if keyword.lower() not in [k.lower() for k in self.spam_keywords]:
             self.spam_keywords.append(keyword.lower())
+            self._spam_re = compile_spam_keywords(self.spam_keywords)
             logger.info(f"Mot-clé spam ajouté : {keyword}")
     
     def remove_spam_keyword(self, keyword: str) -> bool:
         """Supprime un mot-clé de spam."""
         try:
             self.spam_keywords.remove(keyword.lower())
+            self._spam_re = compile_spam_keywords(self.spam_keywords)
             logger.info(f"Mot-clé spam supprimé : {keyword}")
             return True
         except ValueError:
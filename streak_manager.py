@@ -1,6 +1,6 @@
 
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Dict, Optional
 from database import DatabaseManager
 
@@ -14,8 +14,8 @@ class StreakManager:
     def _init_streak_table(self):
         """Initialise la table des streaks."""
         try:
-            with self.db.connection() as conn:
-                cursor = conn.cursor()
+            # Table et index créés dans une seule transaction d'écriture
+            with self.db.txn() as cursor:
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS user_streaks (
                         user_id INTEGER PRIMARY KEY,
@@ -31,17 +31,14 @@ class StreakManager:
                 # Index pour optimiser les requêtes
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_streaks_current ON user_streaks(current_streak DESC)")
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_streaks_best ON user_streaks(best_streak DESC)")
-                
-                conn.commit()
         except Exception as e:
             logger.error(f"Erreur initialisation table streaks: {e}")
     
     def update_user_streak(self, user_id: int, is_correct: bool):
         """Met à jour le streak d'un utilisateur après une réponse."""
         try:
-            with self.db.connection() as conn:
-                cursor = conn.cursor()
-                
+            # Lecture et écriture dans la même transaction : pas de mise à jour perdue
+            with self.db.txn() as cursor:
                 # Récupérer le streak actuel
                 cursor.execute("""
                     SELECT current_streak, best_streak, last_correct_date, streak_broken_count
@@ -53,7 +50,7 @@ class StreakManager:
                 
                 if result:
                     current_streak, best_streak, last_correct_date, broken_count = result
-                    last_date = datetime.strptime(last_correct_date, '%Y-%m-%d').date() if last_correct_date else None
+                    last_date = date.fromisoformat(last_correct_date) if last_correct_date else None
                 else:
                     current_streak, best_streak, last_date, broken_count = 0, 0, None, 0
                 
@@ -88,8 +85,6 @@ class StreakManager:
                     VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
                 """, (user_id, current_streak, best_streak, last_correct_date, broken_count))
                 
-                conn.commit()
-                
                 return {
                     'current_streak': current_streak,
                     'best_streak': best_streak,
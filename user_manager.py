@@ -1,6 +1,6 @@
 
 import logging
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from database import DatabaseManager
 from config import POINTS_PER_CORRECT_ANSWER
 from cache_manager import global_cache, cache_result
@@ -45,13 +45,14 @@ class UserManager:
             stars_earned = POINTS_PER_CORRECT_ANSWER if is_correct else 0
             new_stars = user_score['stars'] + stars_earned
             
-            # Mettre à jour en base
-            self.db.update_user_score(user_id, name, new_correct, new_total, new_stars)
-            self.db.add_user_grade(user_id, question, is_correct, stars_earned)
+            # Score et note mis en file ensemble : validés avec les réponses voisines
+            self.db.record_user_answer(user_id, name, new_correct, new_total, new_stars,
+                                       question, is_correct, stars_earned)
             
             # Invalider les caches liés aux classements et stats
             self._invalidate_ranking_caches()
             global_cache.delete("global_stats")
+            global_cache.delete(f"diff_user_{user_id}")
             
             # Incrémenter le compteur d'activité récente
             activity_key = "recent_activity"
@@ -72,11 +73,18 @@ class UserManager:
             try:
                 from badge_manager import BadgeManager
                 badge_manager = BadgeManager(self.db)
-                updated_stats = self.get_user_stats(user_id)
-                if updated_stats:
-                    new_badges = badge_manager.check_user_badges(user_id, updated_stats)
-                    if new_badges:
-                        logger.info(f"Nouveaux badges pour {name}: {[b['name'] for b in new_badges]}")
+                # Les faits des badges et le rang sont lus en base : valider la réponse d'abord
+                self.db.flush()
+                # Stats construites à partir des nouveaux scores : les conditions des badges
+                # n'utilisent pas l'historique des notes (get_user_stats le relirait en entier)
+                updated_stats = {
+                    'user_id': user_id,
+                    'basic': {'correct': new_correct, 'total': new_total, 'name': name, 'stars': new_stars},
+                    'percentage': (new_correct / max(new_total, 1)) * 100
+                }
+                new_badges = badge_manager.check_user_badges(user_id, updated_stats)
+                if new_badges:
+                    logger.info(f"Nouveaux badges pour {name}: {[b['name'] for b in new_badges]}")
             except Exception as e:
                 logger.error(f"Erreur vérification badges: {e}")
             
@@ -94,13 +102,7 @@ class UserManager:
     
     def _invalidate_ranking_caches(self):
         """Invalide tous les caches de classement."""
-        keys_to_delete = []
-        for key in global_cache.cache.keys():
-            if key.startswith('ranking:'):
-                keys_to_delete.append(key)
-        
-        for key in keys_to_delete:
-            global_cache.delete(key)
+        global_cache.delete_prefix(('ranking:', 'ranking_page:'))
     
     def get_user_stats(self, user_id: int) -> Optional[Dict]:
         """Récupère les statistiques détaillées d'un utilisateur."""
@@ -113,6 +115,7 @@ class UserManager:
             percentage = (user_score['correct'] / max(user_score['total'], 1)) * 100
             
             return {
+                'user_id': user_id,
                 'basic': user_score,
                 'grades': user_grades,
                 'percentage': percentage
@@ -125,9 +128,28 @@ class UserManager:
         """Récupère le classement des utilisateurs avec cache (version legacy)."""
         return self.get_ranking_paginated(page=1, per_page=limit, group_only=group_only)['ranking']
     
-    def get_ranking_paginated(self, page: int = 1, per_page: int = 20, group_only: bool = False) -> Dict:
-        """Récupère le classement paginé avec cache optimisé."""
-        cache_key = f"ranking_page:{page}:{per_page}:{group_only}"
+    def get_user_rank(self, user_id: int) -> Optional[int]:
+        """Calcule la position d'un utilisateur dans le classement général en une requête."""
+        try:
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT 1 + (
+                        SELECT COUNT(*) FROM user_scores o
+                        WHERE o.stars > me.stars OR (o.stars = me.stars AND o.correct > me.correct)
+                    )
+                    FROM user_scores me WHERE me.user_id = ?
+                """, (user_id,))
+                result = cursor.fetchone()
+                return result[0] if result else None
+        except Exception as e:
+            logger.error(f"Erreur calcul rang utilisateur {user_id}: {e}")
+            return None
+    
+    def get_ranking_paginated(self, page: int = 1, per_page: int = 20, group_only: bool = False,
+                              after: Optional[Tuple[int, int, int]] = None) -> Dict:
+        """Récupère le classement paginé avec cache optimisé (after : voir DatabaseManager)."""
+        cache_key = f"ranking_page:{page}:{per_page}:{group_only}:{after}"
         
         # Vérifier le cache
         cached_ranking = global_cache.get(cache_key)
@@ -136,7 +158,7 @@ class UserManager:
         
         try:
             # Utiliser la méthode optimisée de la base de données
-            result = self.db.get_ranking_paginated(page, per_page, group_only)
+            result = self.db.get_ranking_paginated(page, per_page, group_only, after=after)
             
             # TTL adaptatif basé sur l'activité
             activity_key = "recent_activity"